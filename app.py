@@ -1,21 +1,39 @@
 import io
+import os
 import csv
 import json
+import codecs
+import importlib.util
 import time
+import math
+import uuid
+import asyncio
+import threading
 from pathlib import Path
 from typing import List, Dict, Any
-from collections import OrderedDict
+from itertools import repeat
+from collections import OrderedDict, deque
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 import numpy as np
 import pandas as pd
-import requests
-from flask import Flask, render_template, request, jsonify, Response, send_file
-
-from crawler import crawl_region
-from db import fetch_geojson, list_categories
+from flask import Flask, render_template, request, jsonify, Response, send_file, send_from_directory
+
+from crawler import crawl_region, crawl_regions_async, PAGE_SIZE, RESULT_CAP
+from keypool import KeyPool, ApiStatusError
+from jobs import Job, JobManager, JobCancelled
+from coords import to_wgs84, to_gcj02
+from db import (fetch_geojson, iter_geojson, query_clusters, points_in_bbox, data_version,
+                list_categories, list_ak_usage, get_writer, init_db, get_job, list_jobs, iter_rows,
+                clear_checkpoints)
+from http_pool import http_get
+from ratelimit import get_limiter, limit
+import mvt
 
 app = Flask(__name__, template_folder="templates", static_folder="static")
+init_db()
 
 DEFAULT_QUERIES = [
     "美食","酒店","购物","生活服务","休闲娱乐","运动健身","教育培训",
@@ -46,17 +64,22 @@ UPLOAD_DIR = Path("./_uploads"); UPLOAD_DIR.mkdir(exist_ok=True)
 EXPORT_DIR = Path("./_exports"); EXPORT_DIR.mkdir(exist_ok=True)
 
 LATEST_GEOJSON: Dict[str, Any] = {}
+# 最近一次合并结果写出的文件；流式合并不在内存里保留 GeoJSON，导出地图时从这里读
+LATEST_GEOJSON_FILE: Path = None
 
 def _http_get(params: Dict[str, Any], retry: int = 3, backoff: float = 1.5) -> Dict[str, Any]:
     last = None
+    limiter = get_limiter(params.get("ak", ""))
     for i in range(retry):
         try:
-            r = requests.get(BAIDU_REGION_API, params=params, timeout=20)
+            limiter.acquire()
+            r = http_get(BAIDU_REGION_API, params=params, timeout=20)
             r.raise_for_status()
             return r.json()
         except Exception as e:
             last = e
-            time.sleep((backoff ** i) * 0.7)
+            if i + 1 < retry:
+                time.sleep((backoff ** i) * 0.7)
     raise last or RuntimeError("request failed")
 
 def _get_name(node: Dict[str, Any]) -> str:
@@ -185,50 +208,87 @@ def _fetch_all_once(ak: str) -> List[Dict[str, Any]]:
         raise RuntimeError("返回为空（未找到省级列表）")
     return provs
 
-def _fetch_all_by_province(ak: str) -> List[Dict[str, Any]]:
-    d = _http_get({"keyword":"中国","sub_admin":1,"extensions_code":1,"ak":ak})
-    if d.get("status") not in (0, "0"):
-        raise RuntimeError(f"API status={d.get('status')} msg={d.get('message') or d.get('msg')}")
-    root = _extract_provinces_from_resp(d)
-    if not root:
-        raise RuntimeError("返回为空（省级列表）")
-    provinces = []
-    for p in root:
-        pname = _get_name(p)
-        if not pname:
-            continue
-        d2 = _http_get({"keyword": pname, "sub_admin": 2, "extensions_code": 1, "ak": ak})
-        if d2.get("status") not in (0, "0"):
-            raise RuntimeError(f"[{pname}] API status={d2.get('status')} msg={d2.get('message') or d2.get('msg')}")
-        node_list = _extract_provinces_from_resp(d2)
-        if node_list and _get_name(node_list[0]) == pname:
-            node = node_list[0]
-        else:
-            node = {"name": pname, "sub": node_list}
-        provinces.append(node)
-        time.sleep(0.25)
-    return provinces
+# 分省抓取的并发数、单省重试次数与刷新期间对该 AK 声明的限速（与同时在跑的抓取任务取较严者）
+REGION_WORKERS = 8
+PROVINCE_RETRY = 3
+REGION_QPS = 20
 
-def _ensure_regions_cache(ak: str, refresh: bool = False,
-                          exclude_hkm: bool = False, exclude_tw: bool = False) -> Dict[str, Any]:
-    if REG_FILE.exists() and not refresh:
+def _fetch_province(ak: str, pname: str) -> Dict[str, Any]:
+    last = None
+    # 传输错误和非 0 状态共用这一层重试；_http_get 只发一次，避免 3×3 的嵌套重试
+    for i in range(PROVINCE_RETRY):
+        try:
+            d2 = _http_get({"keyword": pname, "sub_admin": 2, "extensions_code": 1, "ak": ak}, retry=1)
+        except Exception as e:
+            last = e
+        else:
+            if d2.get("status") in (0, "0"):
+                node_list = _extract_provinces_from_resp(d2)
+                if node_list and _get_name(node_list[0]) == pname:
+                    return node_list[0]
+                return {"name": pname, "sub": node_list}
+            last = ApiStatusError(d2.get("status"), d2.get("message") or d2.get("msg"))
+            if last.key_dead:
+                break
+        if i + 1 < PROVINCE_RETRY:
+            time.sleep(0.5 * (i + 1))
+    raise RuntimeError(f"[{pname}] {last}")
+
+def _fetch_all_by_province(ak: str):
+    # 各省并发请求；失败的省份保留 sub_admin=1 返回的节点，并在 failed 里记下原因供调用方合并旧缓存
+    with limit(ak, REGION_QPS, burst=REGION_WORKERS):
+        d = _http_get({"keyword":"中国","sub_admin":1,"extensions_code":1,"ak":ak})
+        if d.get("status") not in (0, "0"):
+            raise RuntimeError(f"API status={d.get('status')} msg={d.get('message') or d.get('msg')}")
+        root = [p for p in _extract_provinces_from_resp(d) if _get_name(p)]
+        if not root:
+            raise RuntimeError("返回为空（省级列表）")
+        with ThreadPoolExecutor(max_workers=REGION_WORKERS) as ex:
+            futs = [ex.submit(_fetch_province, ak, _get_name(p)) for p in root]
+    provinces, failed = [], {}
+    for p, fut in zip(root, futs):
+        try:
+            provinces.append(fut.result())
+        except Exception as e:
+            failed[_get_name(p)] = str(e)
+            provinces.append(p)
+    if len(failed) == len(root):
+        raise RuntimeError(next(iter(failed.values())))
+    return provinces, failed
+
+def _read_regions_cache() -> Dict[str, Any]:
+    if REG_FILE.exists():
         try:
             data = json.loads(REG_FILE.read_text(encoding="utf-8"))
             if isinstance(data, dict) and data:
                 return data
         except Exception:
             pass
+    return {}
+
+def _ensure_regions_cache(ak: str, refresh: bool = False,
+                          exclude_hkm: bool = False, exclude_tw: bool = False) -> Dict[str, Any]:
+    cached = _read_regions_cache()
+    if cached and not refresh:
+        return cached
 
     if not ak:
         REG_FILE.write_text(json.dumps(FALLBACK_REGIONS, ensure_ascii=False, indent=2), encoding="utf-8")
         return FALLBACK_REGIONS
 
+    failed = {}
     try:
         provs = _fetch_all_once(ak)
     except Exception:
-        provs = _fetch_all_by_province(ak)
+        provs, failed = _fetch_all_by_province(ak)
 
     mapping = _normalize_mapping(provs, exclude_hkm=exclude_hkm, exclude_tw=exclude_tw)
+    # 个别省份重试后仍失败：沿用旧缓存里该省的数据，没有旧数据时只保留地级市
+    for pname in failed:
+        if pname in cached and pname in mapping:
+            mapping[pname] = cached[pname]
+    if failed:
+        app.logger.warning("行政区刷新部分失败：%s", "；".join(failed.values()))
     if not mapping:
         mapping = FALLBACK_REGIONS
     REG_FILE.write_text(json.dumps(mapping, ensure_ascii=False, indent=2), encoding="utf-8")
@@ -240,7 +300,7 @@ def index():
 
 @app.route("/regions")
 def regions():
-    ak = (request.args.get("ak") or "").strip()
+    ak = (request.args.get("ak") or "").replace("\n", ",").split(",")[0].strip()
     refresh = request.args.get("refresh", "0").lower() in ("1", "true", "yes")
     try:
         mapping = _ensure_regions_cache(ak=ak, refresh=refresh)
@@ -255,9 +315,13 @@ def crawl():
     except Exception:
         return jsonify({"ok": False, "error": "请求体不是合法 JSON"}), 400
 
-    ak = (data.get("ak") or "").strip()
-    if not ak:
+    aks = data.get("aks") or []
+    if isinstance(aks, str):
+        aks = [aks]
+    aks = [a.strip() for a in list(aks) + (data.get("ak") or "").replace("\n", ",").split(",") if a and a.strip()]
+    if not aks:
         return jsonify({"ok": False, "error": "缺少 AK"}), 400
+    ak = aks[0]
 
     reg_json = _ensure_regions_cache(ak=ak, refresh=False)
 
@@ -287,47 +351,335 @@ def crawl():
     except Exception:
         qps = 2.0
     city_limit = bool(data.get("city_limit", True))
+    engine = (data.get("engine") or "sync").strip().lower()
+    try:
+        concurrency = int(data.get("concurrency", 8))
+    except Exception:
+        concurrency = 8
+    try:
+        burst = int(data["burst"]) if data.get("burst") else None
+    except Exception:
+        burst = None
+    subdivide = bool(data.get("subdivide", False))
+    try:
+        daily_quota = int(data["daily_quota"]) if data.get("daily_quota") else None
+    except Exception:
+        daily_quota = None
 
     try:
         regions = _regions_to_crawl(province, city, district)
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 400
 
-    summary = {"ok": True, "regions": regions, "inserted_or_updated": 0, "per_region": [], "errors": []}
-    for reg in regions:
-        try:
-            stats = crawl_region(ak=ak, region=reg, queries=queries, qps=qps, city_limit=city_limit)
+    params = {"aks": aks, "regions": regions, "queries": queries, "qps": qps, "city_limit": city_limit,
+              "engine": engine, "concurrency": concurrency, "burst": burst, "subdivide": subdivide,
+              "daily_quota": daily_quota}
+    job_id = _crawl_jobs().submit(params)
+    return jsonify({"ok": True, "job_id": job_id, "regions": regions, "status_url": f"/jobs/{job_id}"}), 202
+
+# 进度事件里的请求速率按最近 RATE_WINDOW 秒内取到的页数计算
+RATE_WINDOW = 10.0
+
+class _CrawlProgress:
+    # 把 crawler 的逐页回调汇总成 SSE 事件；回调在抓取线程里执行，只做计数和一次内存追加
+    def __init__(self, job: Job, regions: List[str], queries: List[str]):
+        self.job = job
+        self.units = max(1, len(regions) * len(queries))
+        self.queries = queries
+        self.started = time.monotonic()
+        self.pages = 0
+        self.rows = 0
+        self.errors = 0
+        self._recent: deque = deque()
+        self._seen: Dict[tuple, int] = {}
+        self._frac: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def _eta(self, now: float):
+        done = sum(self._frac.values())
+        if done <= 0:
+            return None
+        return round((now - self.started) * (self.units - done) / done, 1)
+
+    def on_page(self, region: str, query: str, page: int, n: int, total: int):
+        # 每页检查一次取消：抛出的 JobCancelled 沿抓取调用栈冒出，同步与异步引擎都在下一页前停下
+        self.job.check_cancelled()
+        now = time.monotonic()
+        with self._lock:
+            self.pages += 1
+            self.rows += n
+            self._recent.append(now)
+            while now - self._recent[0] > RATE_WINDOW:
+                self._recent.popleft()
+            span = now - self._recent[0]
+            rate = (len(self._recent) - 1) / span if span > 0 else 0.0
+            key = (region, query)
+            seen = self._seen[key] = self._seen.get(key, 0) + 1
+            # 不知道总页数时按已翻页数粗估，最多算到九成
+            pages_total = math.ceil(min(total, RESULT_CAP) / PAGE_SIZE) if total else 0
+            self._frac[key] = min(1.0, seen / pages_total) if pages_total else min(0.9, seen / (seen + 1))
+            ev = {"region": region, "query": query, "page": page, "rows": n, "rows_total": self.rows,
+                  "pages": self.pages, "rate": round(rate, 2), "eta": self._eta(now), "errors": self.errors}
+        self.job.emit("page", **ev)
+        self.job.progress(pages=self.pages, rows=self.rows, rate=ev["rate"], eta=ev["eta"])
+
+    def region_done(self, region: str):
+        with self._lock:
+            for q in self.queries:
+                self._frac[(region, q)] = 1.0
+
+    def error(self, region: str, err: str):
+        with self._lock:
+            self.errors += 1
+            self._frac.update({(region, q): 1.0 for q in self.queries})
+            eta = self._eta(time.monotonic())
+        self.job.emit("crawl_error", region=region, error=err, errors=self.errors, eta=eta)
+
+def _run_crawl_job(job: Job) -> Dict[str, Any]:
+    p = job.params
+    pool = KeyPool(p["aks"], qps=p["qps"], burst=p.get("burst"), daily_quota=p.get("daily_quota"))
+    try:
+        return _crawl_job_regions(job, pool)
+    finally:
+        pool.close()
+
+def _crawl_job_regions(job: Job, pool: KeyPool) -> Dict[str, Any]:
+    p = job.params
+    regions, queries, qps = p["regions"], p["queries"], p["qps"]
+    tracker = _CrawlProgress(job, regions, queries)
+    job.progress(force=True, regions_total=len(regions), regions_done=0, inserted_or_updated=0)
+
+    summary = {"ok": True, "regions": regions, "inserted_or_updated": 0, "requests_saved": 0,
+               "per_region": [], "errors": []}
+    if p.get("engine") == "async":
+        results = asyncio.run(crawl_regions_async(ak=pool, regions=regions, queries=queries, qps=qps,
+                                                  city_limit=p["city_limit"], concurrency=p["concurrency"],
+                                                  burst=p.get("burst"), subdivide=p.get("subdivide", False),
+                                                  checkpoint=job.id, on_page=tracker.on_page))
+        if job.cancelled:
+            raise JobCancelled(job.id)
+        for reg, stats in results:
+            if isinstance(stats, BaseException):
+                summary["errors"].append({"region": reg, "error": str(stats)})
+                tracker.error(reg, str(stats))
+                continue
             summary["per_region"].append({"region": reg, **stats})
             summary["inserted_or_updated"] += stats["inserted_or_updated"]
-        except Exception as e:
-            summary["errors"].append({"region": reg, "error": str(e)})
-    return jsonify(summary), (200 if not summary["errors"] else 207)
+            summary["requests_saved"] += stats["requests_saved"]
+    else:
+        for i, reg in enumerate(regions):
+            job.check_cancelled()
+            try:
+                stats = crawl_region(ak=pool, region=reg, queries=queries, qps=qps, city_limit=p["city_limit"],
+                                     burst=p.get("burst"), subdivide=p.get("subdivide", False),
+                                     checkpoint=job.id, on_page=tracker.on_page)
+                summary["per_region"].append({"region": reg, **stats})
+                summary["inserted_or_updated"] += stats["inserted_or_updated"]
+                summary["requests_saved"] += stats["requests_saved"]
+                tracker.region_done(reg)
+            except JobCancelled:
+                raise
+            except Exception as e:
+                summary["errors"].append({"region": reg, "error": str(e)})
+                tracker.error(reg, str(e))
+            job.progress(regions_done=i + 1, inserted_or_updated=summary["inserted_or_updated"],
+                         errors=len(summary["errors"]))
+    job.progress(force=True, regions_done=len(regions), inserted_or_updated=summary["inserted_or_updated"],
+                 errors=len(summary["errors"]))
+    # 全部区县都成功才删断点；有失败时保留，重试任务从断点续跑
+    if not summary["errors"]:
+        clear_checkpoints(job.id)
+    summary["keys"] = pool.stats()
+    summary["writer"] = get_writer().stats()
+    return summary
+
+# 后台抓取任务：python app.py 启动时在真正提供服务的进程里启动 worker（见文件末尾），
+# 以 WSGI 方式部署时在第一个请求到来时启动；import app 本身不启动，避免脚本里引用时接管排队任务
+JOB_WORKERS = 2
+_crawl_job_manager = None
+
+def _crawl_jobs() -> JobManager:
+    global _crawl_job_manager
+    if _crawl_job_manager is None:
+        _crawl_job_manager = JobManager("crawl", _run_crawl_job, workers=JOB_WORKERS)
+    _crawl_job_manager.start()
+    return _crawl_job_manager
+
+@app.before_request
+def _ensure_job_workers():
+    _crawl_jobs()
+
+def _public_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    params = dict(job["params"])
+    params["aks"] = [a[:4] + "***" + a[-4:] for a in params.get("aks", [])]
+    return {**job, "params": params}
+
+@app.route("/jobs")
+def jobs_list():
+    return jsonify([_public_job(j) for j in list_jobs(limit=request.args.get("limit", 50, type=int))])
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id: str):
+    job = get_job(job_id)
+    if not job:
+        return jsonify({"ok": False, "error": "任务不存在"}), 404
+    return jsonify(_public_job(job))
+
+@app.route("/jobs/<job_id>/cancel", methods=["POST"])
+def job_cancel(job_id: str):
+    ok = _crawl_jobs().cancel(job_id)
+    return jsonify({"ok": ok}), (200 if ok else 409)
+
+# SSE：没有新事件时每隔 SSE_KEEPALIVE 秒发一行注释，防止代理断开空闲连接
+SSE_KEEPALIVE = 15.0
+
+def _sse(event: str, data: Dict[str, Any], seq: int = None) -> str:
+    head = f"id: {seq}\n" if seq is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.route("/crawl/<job_id>/events")
+def crawl_events(job_id: str):
+    # 浏览器断线重连时带 Last-Event-ID，从下一条事件接着推
+    manager = _crawl_jobs()
+    job = get_job(job_id)
+    if not job:
+        return jsonify({"ok": False, "error": "任务不存在"}), 404
+    log = manager.events(job_id, create=job["status"] in ("queued", "running"))
+    try:
+        after = int(request.headers.get("Last-Event-ID") or request.args.get("after") or 0)
+    except ValueError:
+        after = 0
+
+    def gen():
+        yield "retry: 3000\n\n"
+        if log is None:
+            # 本进程里没有这个任务的事件（早已结束）：推送一次最终状态即结束
+            yield _sse("end", {"status": job["status"], "progress": job["progress"], "error": job["error"],
+                               "result": job["result"]})
+            return
+        seq = after
+        while True:
+            items, closed = log.since(seq, timeout=SSE_KEEPALIVE)
+            if not items and not closed:
+                yield ": keepalive\n\n"
+                continue
+            for seq, event, data in items:
+                yield _sse(event, data, seq)
+            if closed:
+                return
+
+    return Response(gen(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/jobs/<job_id>/retry", methods=["POST"])
+def job_retry(job_id: str):
+    # 按断点续跑：已完成的 (区县, 关键词) 跳过，已入库的页不再请求
+    ok = _crawl_jobs().retry(job_id)
+    return jsonify({"ok": ok, "status_url": f"/jobs/{job_id}"}), (200 if ok else 409)
+
+@app.route("/ak_usage")
+def ak_usage():
+    try:
+        days = int(request.args.get("days", 7))
+    except Exception:
+        days = 7
+    rows = list_ak_usage(days=days)
+    for r in rows:
+        r["ak"] = r["ak"][:4] + "***" + r["ak"][-4:]
+    return jsonify(rows)
+
+# 视口请求按缩放级别限制单次返回的点数，低缩放级别下避免一次把整个省的点都发给浏览器
+ZOOM_LIMITS = [(6, 500), (9, 2000), (12, 5000)]
+MAX_VIEWPORT_FEATURES = 20000
+
+def _zoom_limit(zoom: int) -> int:
+    for z, n in ZOOM_LIMITS:
+        if zoom <= z:
+            return n
+    return MAX_VIEWPORT_FEATURES
+
+def _parse_bbox(raw: str):
+    # bbox=min_lng,min_lat,max_lng,max_lat（WGS-84，与 Leaflet 的 toBBoxString() 相同顺序）
+    if not raw:
+        return None
+    try:
+        vals = [float(x) for x in raw.split(",")]
+    except ValueError:
+        raise ValueError("bbox 格式应为 min_lng,min_lat,max_lng,max_lat")
+    if len(vals) != 4 or vals[0] > vals[2] or vals[1] > vals[3]:
+        raise ValueError("bbox 格式应为 min_lng,min_lat,max_lng,max_lat")
+    return tuple(vals)
 
 @app.route("/data")
 def data_api():
     source_query = request.args.get("source_query")
-    return jsonify(fetch_geojson(source_query=source_query))
+    try:
+        bbox = _parse_bbox(request.args.get("bbox"))
+        limit = int(request.args["limit"]) if request.args.get("limit") else None
+        if bbox and request.args.get("zoom"):
+            zlimit = _zoom_limit(int(float(request.args["zoom"])))
+            limit = min(limit, zlimit) if limit else zlimit
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    return Response(iter_geojson(source_query=source_query, bbox=bbox, limit=limit), mimetype="application/json")
+
+@app.route("/clusters")
+def clusters():
+    try:
+        bbox = _parse_bbox(request.args.get("bbox")) or (-180.0, -90.0, 180.0, 90.0)
+        zoom = int(float(request.args.get("zoom", 4)))
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    return jsonify(query_clusters(*bbox, zoom=zoom, source_query=request.args.get("source_query")))
+
+@app.route("/tiles/<int:z>/<int:x>/<int:y>.mvt")
+def vector_tile(z: int, x: int, y: int):
+    n = 2 ** z
+    if z < 0 or z > 22 or not (0 <= x < n and 0 <= y < n):
+        return jsonify({"ok": False, "error": "瓦片坐标无效"}), 400
+    version = data_version()
+    data = mvt.read_cached(version, z, x, y)
+    if data is None:
+        rows = points_in_bbox(*mvt.tile_bbox(z, x, y, buffer=mvt.BUFFER), limit=_zoom_limit(z))
+        data = mvt.build_tile(rows, z, x, y)
+        mvt.write_cached(version, z, x, y, data)
+    return Response(data, mimetype="application/vnd.mapbox-vector-tile",
+                    headers={"Cache-Control": "no-cache", "ETag": f"W/\"{version}-{z}-{x}-{y}\""})
+
+@app.route("/map_mvt")
+def map_mvt_page():
+    return render_template("map_mvt.html")
 
 @app.route("/categories")
 def categories():
     return jsonify(list_categories())
 
+# 导出时每次从游标取的行数；每批编码成一个响应块
+EXPORT_BATCH_ROWS = 5000
+
+def _iter_csv_export(batch: int = EXPORT_BATCH_ROWS, **filters):
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    buf.write("\ufeff")  # BOM for Excel
+    w.writerow(CSV_FIELDS)
+    for rows in iter_rows(CSV_FIELDS, batch=batch, **filters):
+        w.writerows(rows)
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
 @app.route("/export_csv")
 def export_csv():
-    geo = fetch_geojson()
-    rows: List[Dict[str, Any]] = []
-    for f in geo.get("features", []):
-        prop = f.get("properties", {})
-        r = {k: prop.get(k, "") for k in CSV_FIELDS}
-        lng, lat = (f.get("geometry", {}).get("coordinates") or [None, None])
-        r["lng"], r["lat"] = lng, lat
-        rows.append(r)
-    si = io.StringIO(); si.write("\ufeff")  # BOM for Excel
-    w = csv.DictWriter(si, fieldnames=CSV_FIELDS); w.writeheader()
-    for r in rows: w.writerow(r)
-    data = si.getvalue().encode("utf-8")
+    # 可选过滤：source_query / city / adcode / bbox（WGS-84，同 /data）；边读游标边输出，内存占用与表大小无关
+    try:
+        bbox = _parse_bbox(request.args.get("bbox"))
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    filters = {k: request.args.get(k) or None for k in ("source_query", "city", "adcode")}
     return Response(
-        data,
+        _iter_csv_export(bbox=bbox, **filters),
         mimetype="text/csv; charset=utf-8",
         headers={"Content-Disposition": f"attachment; filename=poi_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"}
     )
@@ -369,27 +721,77 @@ def _first_exist(cols: List[str], candidates: List[str]):
             return low[k.lower()]
     return None
 
-def read_csv_safely(file_storage) -> pd.DataFrame:
-    file_storage.stream.seek(0)
+# 编码与分隔符只从文件开头这么多字节里判断，之后整份文件只解析一次
+CSV_SNIFF_BYTES = 64 * 1024
+CSV_DELIMITERS = ",\t;|"
+# 采样只看文件开头，后面出现解码错误时整体改用 gb18030 重读一次（gb18030 能解码所有 gbk/gb2312 文本）
+CSV_FALLBACK_ENCODING = "gb18030"
+HAS_PYARROW = importlib.util.find_spec("pyarrow") is not None
+
+def _sniff_csv(head: bytes):
+    if head.startswith(codecs.BOM_UTF8):
+        enc = "utf-8-sig"
+    elif head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        enc = "utf-16"
+    else:
+        try:
+            head.decode("utf-8")
+            enc = "utf-8"
+        except UnicodeDecodeError as e:
+            # 样本恰好截断在多字节字符中间时仍按 utf-8；否则按 gb18030（兼容 gbk/gb2312）
+            enc = "utf-8" if e.start >= len(head) - 3 and len(head) == CSV_SNIFF_BYTES else "gb18030"
+    text = head.decode(enc, errors="ignore")
+    if len(head) == CSV_SNIFF_BYTES and "\n" in text:
+        text = text[:text.rindex("\n")]
     try:
-        return pd.read_csv(file_storage, low_memory=False)
-    except Exception:
-        pass
-    file_storage.stream.seek(0)
+        sep = csv.Sniffer().sniff(text, delimiters=CSV_DELIMITERS).delimiter
+    except csv.Error:
+        sep = ","
+    return enc, sep
+
+def read_csv_safely(file_storage):
+    # 返回 (DataFrame, 读取信息)：读取信息记录探测结果、解析引擎与耗时，放进上传统计
+    t0 = time.perf_counter()
+    stream = file_storage.stream
+    stream.seek(0)
+    enc, sep = _sniff_csv(stream.read(CSV_SNIFF_BYTES))
+    stream.seek(0)
+    t1 = time.perf_counter()
+    info = {"encoding": enc, "sep": sep}
     try:
-        return pd.read_csv(file_storage, encoding="gbk", low_memory=False)
-    except Exception:
-        pass
-    file_storage.stream.seek(0)
-    content = file_storage.read()
-    from csv import Sniffer
+        df, engine = _parse_csv(stream, enc, sep)
+    except UnicodeDecodeError:
+        if enc == CSV_FALLBACK_ENCODING:
+            raise
+        stream.seek(0)
+        info.update(encoding=CSV_FALLBACK_ENCODING, encoding_fallback_from=enc)
+        df, engine = _parse_csv(stream, CSV_FALLBACK_ENCODING, sep)
+    info.update(engine=engine, sniff_ms=round((t1 - t0) * 1000, 1),
+                parse_ms=round((time.perf_counter() - t1) * 1000, 1))
+    return df, info
+
+def _parse_csv(stream, enc: str, sep: str):
+    engine = "pyarrow" if HAS_PYARROW else "c"
     try:
-        dialect = Sniffer().sniff(content[:4096].decode("utf-8", errors="ignore"))
-        return pd.read_csv(io.BytesIO(content), sep=dialect.delimiter, low_memory=False)
+        if engine == "pyarrow":
+            df = pd.read_csv(stream, encoding=enc, sep=sep, engine="pyarrow")
+            # pyarrow 遇到非法 utf-8 不报错，而是把整列读成 bytes；按解码失败处理
+            for c in df.columns[df.dtypes == object]:
+                i = df[c].first_valid_index()
+                if i is not None and isinstance(df[c].at[i], bytes):
+                    raise UnicodeDecodeError(enc, b"", 0, 1, f"列 {c} 无法按 {enc} 解码")
+            return df, engine
+        return pd.read_csv(stream, encoding=enc, sep=sep, low_memory=False), engine
+    except UnicodeDecodeError:
+        raise
     except Exception:
-        return pd.read_csv(io.BytesIO(content), sep=",", low_memory=False)
+        if engine != "pyarrow":
+            raise
+        # pyarrow 对不规整的行更严格，退回 C 引擎再解析一次
+        stream.seek(0)
+        return pd.read_csv(stream, encoding=enc, sep=sep, low_memory=False), "c"
 
-def normalize_df(df: pd.DataFrame) -> pd.DataFrame:
+def normalize_df(df: pd.DataFrame, coord_sys: str = "wgs84") -> pd.DataFrame:
     cols = list(df.columns)
 
     lon_col = _first_exist(cols, LON_CAND)
@@ -421,51 +823,53 @@ def normalize_df(df: pd.DataFrame) -> pd.DataFrame:
     out["lat"] = pd.to_numeric(out["lat"], errors="coerce")
     out = out.dropna(subset=["lon","lat"])
     out = out[(out["lon"] >= -180) & (out["lon"] <= 180) & (out["lat"] >= -90) & (out["lat"] <= 90)]
+    if coord_sys and coord_sys.lower() != "wgs84":
+        lon, lat = to_wgs84(out["lon"].to_numpy(), out["lat"].to_numpy(), coord_sys)
+        out["lon"], out["lat"] = lon, lat
 
     if "source_query" not in out.columns:
         out["source_query"] = "未知"
 
     return out
 
-def _clean_json_value(v):
-    if v is None:
-        return None
-    try:
-        import pandas as pd
-        if pd.isna(v):
-            return None
-    except Exception:
-        pass
-    if isinstance(v, (int, float, str, bool)):
+def _json_scalar(v):
+    if isinstance(v, np.generic):
+        v = v.item()
+    if isinstance(v, float):
+        return v if math.isfinite(v) else None
+    if v is None or isinstance(v, (int, str, bool)):
         return v
     return str(v)
 
-def df_to_geojson(df: pd.DataFrame) -> Dict[str, Any]:
-    wanted = {"name","category","source_query","address","telephone","overall_rating","price","tag","type"}
-    features = []
-    df = df.replace({np.nan: None})
-
-    for _, r in df.iterrows():
-        lon = _clean_json_value(r.get("lon"))
-        lat = _clean_json_value(r.get("lat"))
-        if lon is None or lat is None:
-            continue
-
-        props = {}
-        for k in df.columns:
-            if k in ("lon","lat"):
-                continue
-            if (k in wanted) or True:
-                props[k] = _clean_json_value(r.get(k))
-
-        features.append({
-            "type": "Feature",
-            "geometry": {"type": "Point", "coordinates": [float(lon), float(lat)]},
-            "properties": props
-        })
+def _json_column(values: np.ndarray) -> List[Any]:
+    # 整列转成可直接 json.dumps 的 Python 值：NaN / inf / None 统一为 None，其它非基本类型转字符串
+    kind = values.dtype.kind
+    if kind in "iub":
+        return values.tolist()
+    if kind == "f":
+        out = values.tolist()
+        for i in np.flatnonzero(~np.isfinite(values)).tolist():
+            out[i] = None
+        return out
+    values = values.astype(object, copy=False)
+    out = values.tolist()
+    for i in np.flatnonzero(pd.isna(values)).tolist():
+        out[i] = None
+    return [v if v is None or type(v) in (str, int, bool) else _json_scalar(v) for v in out]
 
-    geojson = {"type": "FeatureCollection", "features": features}
-    return json.loads(json.dumps(geojson, ensure_ascii=False, allow_nan=False))
+def df_to_geojson(df: pd.DataFrame) -> Dict[str, Any]:
+    # 按列一次性转换，再逐行拼 Feature；结果里没有 NaN/inf，调用方只需序列化一次
+    lon = pd.to_numeric(df["lon"], errors="coerce").to_numpy(dtype=float)
+    lat = pd.to_numeric(df["lat"], errors="coerce").to_numpy(dtype=float)
+    ok = np.isfinite(lon) & np.isfinite(lat)
+    keys = [k for k in df.columns if k not in ("lon", "lat")]
+    cols = [_json_column(df[k].to_numpy()[ok]) for k in keys]
+    coords = np.column_stack((lon[ok], lat[ok])).tolist()
+    features = [
+        {"type": "Feature", "geometry": {"type": "Point", "coordinates": c}, "properties": dict(zip(keys, vals))}
+        for c, vals in zip(coords, zip(*cols) if cols else repeat(()))
+    ]
+    return {"type": "FeatureCollection", "features": features}
 
 @app.route("/upload_csv", methods=["POST"])
 def upload_csv():
@@ -475,16 +879,24 @@ def upload_csv():
     if not files:
         return jsonify({"ok": False, "msg": "没有选择文件"}), 400
 
+    coord_sys = (request.form.get("coord_sys") or "wgs84").strip()
+    mode = (request.form.get("mode") or "memory").strip()
+    if mode == "stream":
+        return _upload_csv_streaming(files, coord_sys)
+    if mode == "db":
+        return _upload_csv_to_db(files, coord_sys)
+    if mode != "memory":
+        return jsonify({"ok": False, "msg": f"未知的合并方式：{mode}"}), 400
     frames, stats = [], []
     for f in files:
         if not f.filename.lower().endswith(".csv"):
             stats.append({"file": f.filename, "error": "文件后缀不是 .csv"})
             continue
         try:
-            df = read_csv_safely(f)
-            df_norm = normalize_df(df)
+            df, read_info = read_csv_safely(f)
+            df_norm = normalize_df(df, coord_sys=coord_sys)
             frames.append(df_norm)
-            stats.append({"file": f.filename, "rows": int(len(df_norm))})
+            stats.append({"file": f.filename, "rows": int(len(df_norm)), "read": read_info})
         except Exception as e:
             stats.append({"file": f.filename, "error": str(e)})
 
@@ -492,26 +904,234 @@ def upload_csv():
         return jsonify({"ok": False, "msg": "没有有效的CSV文件", "files": stats}), 400
 
     merged = pd.concat(frames, ignore_index=True)
-    keys = [c for c in ("lon","lat","name","category") if c in merged.columns]
+    keys = [c for c in ("lon","lat","name","source_query") if c in merged.columns]
     merged = merged.drop_duplicates(subset=keys).reset_index(drop=True)
 
     geojson = df_to_geojson(merged)
-    safe_geojson = json.loads(json.dumps(geojson, ensure_ascii=False, allow_nan=False))
+    # 只序列化一次：同一段文本既写入文件，也原样拼进响应
+    geojson_text = json.dumps(geojson, ensure_ascii=False, allow_nan=False)
 
-    global LATEST_GEOJSON
-    LATEST_GEOJSON = safe_geojson
+    global LATEST_GEOJSON, LATEST_GEOJSON_FILE
+    LATEST_GEOJSON = geojson
     ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-    (UPLOAD_DIR / f"merged_{ts}.geojson").write_text(json.dumps(safe_geojson, ensure_ascii=False), encoding="utf-8")
+    LATEST_GEOJSON_FILE = UPLOAD_DIR / f"merged_{ts}.geojson"
+    LATEST_GEOJSON_FILE.write_text(geojson_text, encoding="utf-8")
 
     center = [float(merged["lat"].mean()), float(merged["lon"].mean())] if len(merged) else [34.0,108.0]
-    return jsonify({
+    head = json.dumps({
         "ok": True,
         "files": stats,
-        "total_points": len(safe_geojson["features"]),
+        "total_points": len(geojson["features"]),
         "center": center,
-        "geojson": safe_geojson
+    }, ensure_ascii=False)
+    return Response(head[:-1] + ', "geojson": ' + geojson_text + "}", mimetype="application/json")
+
+# 流式合并每块的行数：决定峰值内存，与上传文件大小无关
+UPLOAD_CHUNK_ROWS = 100000
+
+def _open_csv_chunks(path: Path, chunk_rows: int = UPLOAD_CHUNK_ROWS):
+    # 与 read_csv_safely 相同的采样探测；pyarrow 引擎不支持分块，这里固定用 C 引擎
+    with open(path, "rb") as fh:
+        enc, sep = _sniff_csv(fh.read(CSV_SNIFF_BYTES))
+    info = {"encoding": enc, "sep": sep, "engine": "c", "chunk_rows": chunk_rows}
+    return _iter_csv_chunks(path, enc, sep, chunk_rows, info), info
+
+def _iter_csv_chunks(path: Path, enc: str, sep: str, chunk_rows: int, info: Dict[str, Any]):
+    # 分块读到中途才遇到解码错误时，改用 gb18030 重开文件并跳过已交出的行继续读；回退记录在 info 里
+    done = 0
+    while True:
+        try:
+            with pd.read_csv(path, encoding=enc, sep=sep, chunksize=chunk_rows, low_memory=False,
+                             skiprows=range(1, done + 1) if done else None) as reader:
+                for chunk in reader:
+                    done += len(chunk)
+                    yield chunk
+            return
+        except UnicodeDecodeError:
+            if enc == CSV_FALLBACK_ENCODING:
+                raise
+            info.update(encoding=CSV_FALLBACK_ENCODING, encoding_fallback_from=enc, encoding_fallback_at_row=done)
+            enc = CSV_FALLBACK_ENCODING
+
+class _SeenHashes:
+    # 跨块去重用的 64 位哈希集合：存成若干有序段，新段不短于末段时两两归并（timsort 对两段有序数据是线性归并），
+    # 段数 O(log N)；查询在每段上 searchsorted，单块开销 O(k log N)，不随已见总数整体重排或复制
+    def __init__(self):
+        self._runs: List[np.ndarray] = []
+
+    def isin(self, h: np.ndarray) -> np.ndarray:
+        out = np.zeros(len(h), dtype=bool)
+        for r in self._runs:
+            i = np.minimum(np.searchsorted(r, h), len(r) - 1)
+            out |= r[i] == h
+        return out
+
+    def add(self, h: np.ndarray):
+        run = np.sort(h)
+        while self._runs and len(self._runs[-1]) <= len(run):
+            run = np.sort(np.concatenate([self._runs.pop(), run]), kind="stable")
+        if len(run):
+            self._runs.append(run)
+
+def _upload_token() -> str:
+    # 秒级时间戳加随机后缀：同一秒内的并发上传各用各的落盘文件与输出文件
+    return datetime.now().strftime("%Y%m%d_%H%M%S") + "_" + uuid.uuid4().hex[:8]
+
+def _upload_csv_streaming(files, coord_sys: str):
+    # 上传先落盘，逐块 normalize_df；按 (lon, lat, name, source_query) 的 64 位哈希跨块去重，GeoJSON 边算边写
+    global LATEST_GEOJSON, LATEST_GEOJSON_FILE
+    ts = _upload_token()
+    out_path = UPLOAD_DIR / f"merged_{ts}.geojson"
+    seen = _SeenHashes()
+    stats = []
+    total, sum_lon, sum_lat = 0, 0.0, 0.0
+    with open(out_path, "w", encoding="utf-8") as out:
+        out.write('{"type": "FeatureCollection", "features": [')
+        for i, f in enumerate(files):
+            if not f.filename.lower().endswith(".csv"):
+                stats.append({"file": f.filename, "error": "文件后缀不是 .csv"})
+                continue
+            spool = UPLOAD_DIR / f"_spool_{ts}_{i}.csv"
+            st = {"file": f.filename, "rows": 0, "duplicates": 0, "chunks": 0}
+            t0 = time.perf_counter()
+            try:
+                f.save(spool)
+                reader, st["read"] = _open_csv_chunks(spool)
+                with closing(reader):
+                    for chunk in reader:
+                        norm = normalize_df(chunk, coord_sys=coord_sys)
+                        keys = [c for c in ("lon", "lat", "name", "source_query") if c in norm.columns]
+                        hashes = pd.util.hash_pandas_object(norm[keys], index=False).to_numpy(np.uint64)
+                        # 块内保留每个哈希的第一次出现，再剔除之前块已出现过的
+                        fresh = np.zeros(len(hashes), dtype=bool)
+                        fresh[np.unique(hashes, return_index=True)[1]] = True
+                        fresh &= ~seen.isin(hashes)
+                        seen.add(hashes[fresh])
+                        st["chunks"] += 1
+                        st["duplicates"] += int(len(hashes) - fresh.sum())
+                        norm = norm[fresh]
+                        if not len(norm):
+                            continue
+                        feats = df_to_geojson(norm)["features"]
+                        out.write(("," if total else "") +
+                                  json.dumps(feats, ensure_ascii=False, allow_nan=False)[1:-1])
+                        total += len(feats)
+                        st["rows"] += len(feats)
+                        sum_lon += float(norm["lon"].sum())
+                        sum_lat += float(norm["lat"].sum())
+            except Exception as e:
+                # 已写出的块保留在结果里，rows 记录出错前写入的条数
+                st["error"] = str(e)
+            finally:
+                spool.unlink(missing_ok=True)
+            st["read"] = {**st.get("read", {}), "parse_ms": round((time.perf_counter() - t0) * 1000, 1)}
+            stats.append(st)
+        out.write("]}")
+
+    if not total:
+        out_path.unlink(missing_ok=True)
+        return jsonify({"ok": False, "msg": "没有有效的CSV文件", "files": stats}), 400
+
+    LATEST_GEOJSON, LATEST_GEOJSON_FILE = {}, out_path
+    return jsonify({
+        "ok": True,
+        "mode": "stream",
+        "files": stats,
+        "total_points": total,
+        "center": [sum_lat / total, sum_lon / total],
+        "geojson_url": f"/uploads/{out_path.name}",
     })
 
+# 导入数据库时其余 CSV 列到 poi 字段的映射（经纬度、名称、关键词、地址、电话、评分、价格由 normalize_df 处理）
+POI_COLUMN_CAND = {
+    # 不认通用的 id 列：行号式的 1..N 会在不同文件间撞主键，互相覆盖
+    "uid": ["uid", "poi_uid", "poi_id"],
+    "province": ["province", "省", "省份"],
+    "city": ["city", "市", "城市"],
+    "area": ["area", "district", "区县", "区"],
+    "adcode": ["adcode", "行政区划代码"],
+    "type": ["type", "poi_type", "类型"],
+    "tag": ["tag", "poi_tag", "标签"],
+    "classified_poi_tag": ["classified_poi_tag"],
+    "shop_hours": ["shop_hours", "营业时间"],
+    "brand": ["brand", "品牌"],
+    "content_tag": ["content_tag"],
+    "detail": ["detail"],
+}
+
+def _text_col(s: pd.Series) -> pd.Series:
+    # 带缺失值的整数列会被读成 float（620102.0），转回整数文本
+    if s.dtype.kind == "f" and np.all(np.mod(s.dropna().to_numpy(), 1) == 0):
+        s = s.astype("Int64")
+    return s.astype(object).where(s.notna(), None).map(lambda v: v if v is None else str(v))
+
+def _poi_rows(raw: pd.DataFrame, norm: pd.DataFrame, coord_sys: str):
+    # norm 是未做坐标转换的 normalize_df 结果（索引与 raw 对齐）；返回可直接交给 BatchWriter 的行及新生成 uid 的数量
+    out = pd.DataFrame(index=norm.index)
+    for k in ("name", "address", "telephone", "overall_rating", "price", "source_query"):
+        out[k] = norm[k] if k in norm.columns else None
+    cols = list(raw.columns)
+    for k, cand in POI_COLUMN_CAND.items():
+        c = _first_exist(cols, cand)
+        out[k] = raw.loc[norm.index, c] if c else None
+    out["uid"] = _text_col(out["uid"])
+    out["adcode"] = _text_col(out["adcode"])
+    out["lng"], out["lat"] = to_gcj02(norm["lon"].to_numpy(), norm["lat"].to_numpy(), coord_sys)
+    # 没有 uid 的行按原始 (经纬度, 名称, 关键词) 哈希生成：同一份文件重复导入得到相同 uid，按主键覆盖而不是重复插入
+    miss = out["uid"].isna() | (out["uid"] == "")
+    if miss.any():
+        keys = [c for c in ("lon", "lat", "name", "source_query") if c in norm.columns]
+        h = pd.util.hash_pandas_object(norm.loc[miss, keys], index=False).tolist()
+        out.loc[miss, "uid"] = [f"csv_{x:016x}" for x in h]
+    cols = [_json_column(out[k].to_numpy()) for k in CSV_FIELDS]
+    return [dict(zip(CSV_FIELDS, vals)) for vals in zip(*cols)], int(miss.sum())
+
+def _upload_csv_to_db(files, coord_sys: str):
+    # 分块读取并写入 poi 表：每块作为一次 put 交给 BatchWriter，整块在一个事务里提交
+    ts = _upload_token()
+    writer = get_writer()
+    owner = object()
+    stats = []
+    total = 0
+    for i, f in enumerate(files):
+        if not f.filename.lower().endswith(".csv"):
+            stats.append({"file": f.filename, "error": "文件后缀不是 .csv"})
+            continue
+        spool = UPLOAD_DIR / f"_spool_{ts}_{i}.csv"
+        st = {"file": f.filename, "rows": 0, "uids_generated": 0, "chunks": 0}
+        t0 = time.perf_counter()
+        try:
+            f.save(spool)
+            reader, st["read"] = _open_csv_chunks(spool)
+            with closing(reader):
+                for chunk in reader:
+                    # 坐标转换放到 _poi_rows 里直接换算到 GCJ-02，避免先转 WGS-84 再转回来的误差
+                    rows, generated = _poi_rows(chunk, normalize_df(chunk, coord_sys="wgs84"), coord_sys)
+                    # 等上一块提交完再交下一块：解析与写库重叠一块，队列里最多积压一块，内存有上界
+                    writer.flush(owner=owner)
+                    writer.put(rows, owner=owner)
+                    st["chunks"] += 1
+                    st["rows"] += len(rows)
+                    st["uids_generated"] += generated
+            writer.flush(owner=owner)
+        except Exception as e:
+            st["error"] = str(e)
+        finally:
+            spool.unlink(missing_ok=True)
+        st["read"] = {**st.get("read", {}), "parse_ms": round((time.perf_counter() - t0) * 1000, 1)}
+        total += st["rows"]
+        stats.append(st)
+
+    if not total:
+        return jsonify({"ok": False, "msg": "没有写入任何数据", "files": stats}), 400
+    return jsonify({"ok": True, "mode": "db", "files": stats, "total_points": total, "writer": writer.stats()})
+
+@app.route("/uploads/<name>")
+def uploaded_geojson(name: str):
+    if not (name.startswith("merged_") and name.endswith(".geojson")):
+        return jsonify({"ok": False, "msg": "文件不存在"}), 404
+    return send_from_directory(UPLOAD_DIR.resolve(), name, mimetype="application/geo+json")
+
 @app.route("/export_map", methods=["POST"])
 def export_map():
     data = request.get_json(silent=True) or {}
@@ -520,7 +1140,11 @@ def export_map():
     center  = data.get("center") or [34.0, 108.0]
     zoom    = int(data.get("zoom") or 7)
 
-    if not geojson or "features" not in geojson:
+    if geojson and "features" in geojson:
+        geojson_text = json.dumps(geojson, ensure_ascii=False)
+    elif LATEST_GEOJSON_FILE and LATEST_GEOJSON_FILE.exists():
+        geojson_text = LATEST_GEOJSON_FILE.read_text(encoding="utf-8")
+    else:
         return jsonify({"ok": False, "msg": "没有可导出的数据，请先上传并可视化"}), 400
 
     html = render_template(
@@ -528,7 +1152,7 @@ def export_map():
         title=title,
         center=center,
         zoom=zoom,
-        geojson=json.dumps(geojson, ensure_ascii=False)
+        geojson=geojson_text
     )
     ts = datetime.now().strftime("%Y%m%d_%H%M%S")
     out_path = EXPORT_DIR / f"map_{ts}.html"
@@ -536,4 +1160,9 @@ def export_map():
     return send_file(out_path, as_attachment=True, download_name=out_path.name, mimetype="text/html; charset=utf-8")
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    debug = True
+    # debug 模式下 reloader 的父进程只负责监视文件，服务在 WERKZEUG_RUN_MAIN=true 的子进程里；
+    # 只在服务进程里恢复重启前排队 / 中断的任务
+    if not debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        _crawl_jobs()
+    app.run(host="0.0.0.0", port=5000, debug=debug)
@@ -0,0 +1,117 @@
+import time
+import argparse
+
+import numpy as np
+
+def _timeit(fn, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+def bench_coords(n: int = 200000):
+    import coords
+    from db import gcj02_to_wgs84
+    rng = np.random.default_rng(0)
+    lng = rng.uniform(73.0, 135.0, n)
+    lat = rng.uniform(18.0, 53.0, n)
+    lng_l, lat_l = lng.tolist(), lat.tolist()
+    rows = [
+        ("scalar gcj02_to_wgs84", _timeit(lambda: [gcj02_to_wgs84(x, y) for x, y in zip(lng_l, lat_l)], 1)),
+        ("numpy gcj02_to_wgs84", _timeit(lambda: coords.gcj02_to_wgs84(lng, lat))),
+        ("numpy gcj02_to_wgs84_exact", _timeit(lambda: coords.gcj02_to_wgs84_exact(lng, lat))),
+        ("numpy gcj02_to_bd09", _timeit(lambda: coords.gcj02_to_bd09(lng, lat))),
+        ("numpy bd09_to_wgs84", _timeit(lambda: coords.bd09_to_wgs84(lng, lat))),
+    ]
+    print(f"coords  n={n}")
+    for name, sec in rows:
+        print(f"  {name:<30} {sec*1000:9.1f} ms  {n/sec:14,.0f} pts/s")
+
+def bench_explain(n: int = 5000):
+    # 在临时库里灌入合成数据，检查热点查询的执行计划：任何一条退化成全表扫描都以非零状态退出
+    import random
+    import tempfile
+    import db
+    old_path = db.DB_PATH
+    tmp = tempfile.TemporaryDirectory()
+    db.configure(db_path=f"{tmp.name}/explain.sqlite")
+    try:
+        rnd = random.Random(0)
+        db.upsert_rows({
+            "uid": f"u{i}", "name": f"p{i}", "address": "", "province": "甘肃省", "city": f"c{i % 14}",
+            "area": f"a{i % 90}", "adcode": str(620000 + i % 90), "lat": 33 + rnd.random() * 8,
+            "lng": 93 + rnd.random() * 14, "type": "", "tag": "", "classified_poi_tag": "", "telephone": "",
+            "detail": 0, "overall_rating": "", "price": "", "shop_hours": "", "brand": "", "content_tag": "",
+            "source_query": f"q{i % 33}"} for i in range(n))
+        results = db.explain_hot_queries()
+    finally:
+        db.configure(db_path=old_path)
+        tmp.cleanup()
+    bad = []
+    print(f"explain  n={n}")
+    for name, r in results.items():
+        flag = "ok  " if r["uses_index"] else "SCAN"
+        print(f"  [{flag}] {name:<22} {' | '.join(r['plan'])}")
+        if not r["uses_index"]:
+            bad.append(name)
+    if bad:
+        raise SystemExit(f"全表扫描：{', '.join(bad)}")
+
+def bench_mvt(n: int = 100000):
+    # 把 n 个点均匀撒在一张 z=12 瓦片里，测编码吞吐（不含查库）
+    import mvt
+    z, x, y = 12, 3229, 1594
+    min_lng, min_lat, max_lng, max_lat = mvt.tile_bbox(z, x, y)
+    rng = np.random.default_rng(0)
+    lngs = rng.uniform(min_lng, max_lng, n).tolist()
+    lats = rng.uniform(min_lat, max_lat, n).tolist()
+    rows = [(lngs[i], lats[i], f"u{i}", f"POI {i}", f"q{i % 33}") for i in range(n)]
+    print(f"mvt  n={n}")
+    for per_tile in (1000, 10000, n):
+        chunks = [rows[i:i + per_tile] for i in range(0, n, per_tile)]
+        size = [0]
+        def run():
+            size[0] = sum(len(mvt.build_tile(c, z, x, y)) for c in chunks)
+        sec = _timeit(run)
+        print(f"  {per_tile:>7} pts/tile  {len(chunks)/sec:10,.1f} tiles/s  {n/sec:12,.0f} features/s"
+              f"  {size[0]/len(chunks)/1024:8.1f} KiB/tile")
+
+def bench_geojson(n: int = 1000000):
+    # 上传合并后的 DataFrame 转 GeoJSON：规模取 n/100、n/10、n，分别计转换与一次序列化的耗时
+    import json
+    import pandas as pd
+    from app import df_to_geojson
+    rng = np.random.default_rng(0)
+    print(f"geojson  n={n}")
+    for size in (n // 100, n // 10, n):
+        rating = rng.uniform(0, 5, size)
+        rating[::7] = np.nan
+        df = pd.DataFrame({
+            "lon": rng.uniform(73.0, 135.0, size), "lat": rng.uniform(18.0, 53.0, size),
+            "name": [f"POI {i}" for i in range(size)], "source_query": [f"q{i % 33}" for i in range(size)],
+            "address": np.where(np.arange(size) % 5 == 0, None, "某路 1 号"), "overall_rating": rating,
+        })
+        out = [None]
+        conv = _timeit(lambda: out.__setitem__(0, df_to_geojson(df)), 1)
+        dump = _timeit(lambda: json.dumps(out[0], ensure_ascii=False, allow_nan=False), 1)
+        print(f"  {size:>9,} rows  convert {conv*1000:9.1f} ms  dumps {dump*1000:9.1f} ms"
+              f"  {size/(conv + dump):12,.0f} rows/s")
+
+BENCHES = {
+    "coords": bench_coords,
+    "explain": bench_explain,
+    "mvt": bench_mvt,
+    "geojson": bench_geojson,
+}
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="POI_FETCH 性能基准")
+    ap.add_argument("names", nargs="*", help="要运行的基准（%s），默认全部" % " / ".join(BENCHES))
+    ap.add_argument("-n", type=int, default=None, help="数据规模")
+    args = ap.parse_args()
+    for name in args.names or list(BENCHES):
+        if name not in BENCHES:
+            ap.error(f"未知基准：{name}")
+        BENCHES[name](**({} if args.n is None else {"n": args.n}))
@@ -0,0 +1,112 @@
+import numpy as np
+
+PI = np.pi
+X_PI = PI * 3000.0 / 180.0
+AXIS = 6378245.0
+EE = 0.00669342162296594323
+
+def _arr(lng, lat):
+    return np.asarray(lng, dtype=np.float64), np.asarray(lat, dtype=np.float64)
+
+def out_of_china(lng, lat) -> np.ndarray:
+    lng, lat = _arr(lng, lat)
+    return ~((lng >= 72.004) & (lng <= 137.8347) & (lat >= 0.8293) & (lat <= 55.8271))
+
+def _transform_lat(x, y):
+    ret = -100.0 + 2.0*x + 3.0*y + 0.2*y*y + 0.1*x*y + 0.2*np.sqrt(np.abs(x))
+    ret += (20.0*np.sin(6.0*x*PI) + 20.0*np.sin(2.0*x*PI))*2.0/3.0
+    ret += (20.0*np.sin(y*PI) + 40.0*np.sin(y/3.0*PI))*2.0/3.0
+    ret += (160.0*np.sin(y/12.0*PI) + 320.0*np.sin(y*PI/30.0))*2.0/3.0
+    return ret
+
+def _transform_lng(x, y):
+    ret = 300.0 + x + 2.0*y + 0.1*x*x + 0.1*x*y + 0.1*np.sqrt(np.abs(x))
+    ret += (20.0*np.sin(6.0*x*PI) + 20.0*np.sin(2.0*x*PI))*2.0/3.0
+    ret += (20.0*np.sin(x*PI) + 40.0*np.sin(x/3.0*PI))*2.0/3.0
+    ret += (150.0*np.sin(x/12.0*PI) + 300.0*np.sin(x/30.0*PI))*2.0/3.0
+    return ret
+
+def _delta(lng, lat):
+    dlat = _transform_lat(lng - 105.0, lat - 35.0)
+    dlng = _transform_lng(lng - 105.0, lat - 35.0)
+    radlat = lat / 180.0 * PI
+    magic = np.sin(radlat)
+    magic = 1 - EE * magic * magic
+    sqrt_magic = np.sqrt(magic)
+    dlat = (dlat * 180.0) / ((AXIS * (1 - EE)) / (magic * sqrt_magic) * PI)
+    dlng = (dlng * 180.0) / (AXIS / sqrt_magic * np.cos(radlat) * PI)
+    return dlng, dlat
+
+def wgs84_to_gcj02(lng, lat):
+    lng, lat = _arr(lng, lat)
+    dlng, dlat = _delta(lng, lat)
+    mask = out_of_china(lng, lat)
+    return np.where(mask, lng, lng + dlng), np.where(mask, lat, lat + dlat)
+
+def gcj02_to_wgs84(lng, lat):
+    # 一阶近似，与 db.gcj02_to_wgs84 结果一致（误差约 1~2 米）
+    lng, lat = _arr(lng, lat)
+    dlng, dlat = _delta(lng, lat)
+    mask = out_of_china(lng, lat)
+    return np.where(mask, lng, lng - dlng), np.where(mask, lat, lat - dlat)
+
+def gcj02_to_wgs84_exact(lng, lat, tol: float = 1e-9, max_iter: int = 30):
+    # 迭代反解：不断修正 WGS 猜测值使其正向加偏后落回输入点，精度可到厘米以下
+    lng, lat = _arr(lng, lat)
+    wlng, wlat = gcj02_to_wgs84(lng, lat)
+    mask = out_of_china(lng, lat)
+    for _ in range(max_iter):
+        glng, glat = wgs84_to_gcj02(wlng, wlat)
+        elng, elat = glng - lng, glat - lat
+        wlng = np.where(mask, wlng, wlng - elng)
+        wlat = np.where(mask, wlat, wlat - elat)
+        err = np.nanmax(np.abs(np.concatenate([np.ravel(elng), np.ravel(elat)])), initial=0.0)
+        if err < tol:
+            break
+    return wlng, wlat
+
+def gcj02_to_bd09(lng, lat):
+    lng, lat = _arr(lng, lat)
+    z = np.sqrt(lng * lng + lat * lat) + 0.00002 * np.sin(lat * X_PI)
+    theta = np.arctan2(lat, lng) + 0.000003 * np.cos(lng * X_PI)
+    return z * np.cos(theta) + 0.0065, z * np.sin(theta) + 0.006
+
+def bd09_to_gcj02(lng, lat):
+    lng, lat = _arr(lng, lat)
+    x, y = lng - 0.0065, lat - 0.006
+    z = np.sqrt(x * x + y * y) - 0.00002 * np.sin(y * X_PI)
+    theta = np.arctan2(y, x) - 0.000003 * np.cos(x * X_PI)
+    return z * np.cos(theta), z * np.sin(theta)
+
+def bd09_to_wgs84(lng, lat, exact: bool = False):
+    g = bd09_to_gcj02(lng, lat)
+    return gcj02_to_wgs84_exact(*g) if exact else gcj02_to_wgs84(*g)
+
+def wgs84_to_bd09(lng, lat):
+    return gcj02_to_bd09(*wgs84_to_gcj02(lng, lat))
+
+# 上传 CSV 等场景按坐标系名称统一转换到 WGS-84
+TO_WGS84 = {
+    "wgs84": lambda lng, lat: _arr(lng, lat),
+    "gcj02": gcj02_to_wgs84,
+    "bd09": bd09_to_wgs84,
+}
+
+# 导入数据库时统一转换到库内使用的 GCJ-02（与百度接口 ret_coordtype=gcj02ll 一致）
+TO_GCJ02 = {
+    "wgs84": wgs84_to_gcj02,
+    "gcj02": lambda lng, lat: _arr(lng, lat),
+    "bd09": bd09_to_gcj02,
+}
+
+def _convert(table, lng, lat, coord_sys: str):
+    fn = table.get((coord_sys or "wgs84").lower().replace("-", "").replace("ll", ""))
+    if fn is None:
+        raise ValueError(f"不支持的坐标系：{coord_sys}（可选 wgs84 / gcj02 / bd09）")
+    return fn(lng, lat)
+
+def to_wgs84(lng, lat, coord_sys: str = "wgs84"):
+    return _convert(TO_WGS84, lng, lat, coord_sys)
+
+def to_gcj02(lng, lat, coord_sys: str = "wgs84"):
+    return _convert(TO_GCJ02, lng, lat, coord_sys)
@@ -1,11 +1,20 @@
-import time, random, requests
-from typing import Dict, Any, List
-from db import upsert_rows
+import time, random, asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Union, Optional, Tuple, Callable
+from db import get_writer, region_extent, load_checkpoints
+from http_pool import http_get
+from ratelimit import get_limiter
+from keypool import KeyPool, ApiStatusError
 
 BASE_URL = "https://api.map.baidu.com/place/v2/search"
 PAGE_SIZE = 20
 MAX_RETRY = 3
 RETRY_BACKOFF = 1.6
+# 单个检索条件最多能翻到的结果数；total 达到该值说明结果被截断，需要切分矩形
+RESULT_CAP = 150
+MIN_CELL_DEG = 0.002
+BOUNDS_PAD = 0.1
 
 def build_params(ak: str, region: str, query: str, page_num: int,
                  ret_coordtype: str = "gcj02ll", city_limit=True):
@@ -23,6 +32,23 @@ def build_params(ak: str, region: str, query: str, page_num: int,
     }
     return p
 
+def build_bounds_params(ak: str, bounds: Tuple[float, float, float, float], query: str, page_num: int,
+                        ret_coordtype: str = "gcj02ll"):
+    # bounds = (min_lat, min_lng, max_lat, max_lng)，坐标系与入库数据一致（coord_type=2 即 gcj02）
+    p = {
+        "query": query,
+        "bounds": "%.6f,%.6f,%.6f,%.6f" % bounds,
+        "coord_type": 2,
+        "output": "json",
+        "ak": ak,
+        "page_size": PAGE_SIZE,
+        "page_num": page_num,
+        "scope": 2,
+        "extensions_adcode": "true",
+        "ret_coordtype": ret_coordtype
+    }
+    return p
+
 def normalize_rows(results: List[Dict[str, Any]], query: str):
     rows = []
     for r in results:
@@ -52,39 +78,293 @@ def normalize_rows(results: List[Dict[str, Any]], query: str):
         })
     return rows
 
-def request_once(params: Dict[str, Any]):
+def request_once(params: Dict[str, Any], on_attempt: Callable[[], None] = None):
+    # on_attempt 在每次真正发出 HTTP 请求前调用（含重试），供 KeyPool 按实际消耗计配额
     last_err = None
+    limiter = get_limiter(params.get("ak", ""))
     for i in range(1, MAX_RETRY+1):
         try:
-            r = requests.get(BASE_URL, params=params, timeout=18)
+            limiter.acquire()
+            if on_attempt:
+                on_attempt()
+            r = http_get(BASE_URL, params=params, timeout=18)
             if r.status_code == 200:
                 data = r.json()
                 if data.get("status") == 0:
                     return data
-                last_err = RuntimeError(f"API status={data.get('status')} msg={data.get('message')}")
+                last_err = ApiStatusError(data.get("status"), data.get("message"))
+                if last_err.key_dead:
+                    raise last_err
             else:
                 last_err = RuntimeError(f"HTTP {r.status_code}")
+        except ApiStatusError:
+            raise
         except Exception as e:
             last_err = e
         time.sleep((0.35 + random.random()*0.25) * (RETRY_BACKOFF**(i-1)))
     raise last_err or RuntimeError("unknown error")
 
-def crawl_region(ak: str, region: str, queries: List[str], qps: float = 2.0, city_limit=True):
-    sleep_base = 1.0 / max(0.5, qps)
+def _total_of(data: Dict[str, Any]) -> int:
+    try:
+        return int(data.get("total") or 0)
+    except (TypeError, ValueError):
+        return 0
+
+def _has_more(data: Dict[str, Any], page_num: int, n: int) -> bool:
+    # 不足一页，或按 total 计算已取完，就不必再请求末尾的空页
+    if n < PAGE_SIZE:
+        return False
+    total = _total_of(data)
+    return not total or (page_num + 1) * PAGE_SIZE < total
+
+def fetch_page(pool: KeyPool, region: str, query: str, page_num: int, city_limit=True):
+    return pool.request(lambda ak: build_params(ak, region, query, page_num, city_limit=city_limit),
+                        request_once)
+
+def _split(b: Tuple[float, float, float, float]):
+    min_lat, min_lng, max_lat, max_lng = b
+    mid_lat, mid_lng = (min_lat + max_lat) / 2, (min_lng + max_lng) / 2
+    return [(min_lat, min_lng, mid_lat, mid_lng), (min_lat, mid_lng, mid_lat, max_lng),
+            (mid_lat, min_lng, max_lat, mid_lng), (mid_lat, mid_lng, max_lat, max_lng)]
+
+def _extent(rows: List[Dict[str, Any]]):
+    pts = [(r["lat"], r["lng"]) for r in rows if r.get("lat") is not None and r.get("lng") is not None]
+    if not pts:
+        return None
+    lats, lngs = zip(*pts)
+    return (min(lats), min(lngs), max(lats), max(lngs))
+
+def _union(a, b):
+    if a is None or b is None:
+        return a or b
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+def _pad(b, ratio: float = BOUNDS_PAD):
+    dlat = max(b[2] - b[0], MIN_CELL_DEG) * ratio
+    dlng = max(b[3] - b[1], MIN_CELL_DEG) * ratio
+    return (b[0] - dlat, b[1] - dlng, b[2] + dlat, b[3] + dlng)
+
+def crawl_bounds(pool: KeyPool, bounds: Tuple[float, float, float, float], query: str,
+                 workers: int = 4, seen: Optional[set] = None):
+    # 四叉树切分：矩形命中 RESULT_CAP 就一分为四，直到每个格子都在上限以内；同层格子并行，按 uid 去重
+    seen = set() if seen is None else seen
+    lock = threading.Lock()
+    stats = {"count": 0, "cells": 0, "requests": 0}
+
+    def _keep_new(rows):
+        with lock:
+            fresh = [r for r in rows if r["uid"] and r["uid"] not in seen]
+            seen.update(r["uid"] for r in fresh)
+        return fresh
+
+    def _cell(b):
+        page, got, reqs = 0, 0, 0
+        while True:
+            data = pool.request(lambda ak: build_bounds_params(ak, b, query, page), request_once)
+            reqs += 1
+            res = data.get("results") or []
+            fresh = _keep_new(normalize_rows(res, query))
+            if fresh:
+                get_writer().put(fresh, owner=pool)
+            got += len(fresh)
+            if page == 0 and _total_of(data) >= RESULT_CAP and (b[2] - b[0]) > MIN_CELL_DEG:
+                return got, reqs, _split(b)
+            if not res or not _has_more(data, page, len(res)):
+                return got, reqs, []
+            page += 1
+
+    cells = [bounds]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
+        while cells:
+            nxt = []
+            for got, reqs, children in ex.map(_cell, cells):
+                stats["count"] += got
+                stats["requests"] += reqs
+                nxt.extend(children)
+            stats["cells"] += len(cells)
+            cells = nxt
+    return stats
+
+def _subdivide(pool: KeyPool, region: str, query: str, rows: List[Dict[str, Any]], workers: int):
+    # 行政区没有现成的外包矩形：用本次结果与库中该区县已有点的范围合并后外扩
+    get_writer().flush(owner=pool)
+    b = _union(_extent(rows), region_extent(region))
+    if b is None:
+        return None
+    return crawl_bounds(pool, _pad(b), query, workers=workers, seen={r["uid"] for r in rows if r["uid"]})
+
+def _cp(checkpoint: Optional[str], region: str, query: str, **kw):
+    return {"job_key": checkpoint, "region": region, "query": query, **kw} if checkpoint else None
+
+def crawl_region(ak: Union[str, List[str], KeyPool], region: str, queries: List[str], qps: float = 2.0,
+                 city_limit=True, burst: int = None, daily_quota: int = None,
+                 subdivide: bool = False, workers: int = 4, checkpoint: str = None,
+                 on_page: Callable = None):
+    # checkpoint 为断点键（通常是任务 id）：已完成的关键词直接跳过，未完成的从下一页接着翻
+    # on_page(region, query, page, n, total) 每取完一页回调一次，用于上报进度，须足够轻量
+    pool = KeyPool.of(ak, qps=qps, burst=burst, daily_quota=daily_quota)
+    try:
+        return _crawl_region(pool, region, queries, city_limit, subdivide, workers, checkpoint, on_page)
+    finally:
+        if pool is not ak:
+            pool.close()
+
+def _crawl_region(pool: KeyPool, region: str, queries: List[str], city_limit: bool, subdivide: bool,
+                  workers: int, checkpoint: Optional[str], on_page: Optional[Callable]):
+    cps = load_checkpoints(checkpoint, region) if checkpoint else {}
     total = 0
+    saved = 0
     per_query_stats = []
     for q in queries:
-        page = 0
-        got = 0
+        cp = cps.get(q) or {"pages": set(), "total": None, "count": 0, "done": False}
+        if cp["done"]:
+            per_query_stats.append({"query": q, "count": cp["count"], "requests_saved": 0, "resumed": True})
+            total += cp["count"]
+            continue
+        page = max(cp["pages"]) + 1 if cp["pages"] else 0
+        got = cp["count"]
+        q_saved = 0
+        capped = (cp["total"] or 0) >= RESULT_CAP
+        q_rows = []
         while True:
-            data = request_once(build_params(ak, region, q, page, city_limit=city_limit))
+            data = fetch_page(pool, region, q, page, city_limit=city_limit)
             res = data.get("results") or []
             if not res:
                 break
-            upsert_rows(normalize_rows(res, q))
+            rows = normalize_rows(res, q)
+            get_writer().put(rows, _cp(checkpoint, region, q, page=page, total=_total_of(data) or None,
+                                       count=len(res)), owner=pool)
             got += len(res)
+            if on_page:
+                on_page(region, q, page, len(res), _total_of(data))
+            capped = capped or _total_of(data) >= RESULT_CAP
+            if subdivide:
+                q_rows.extend(rows)
+            if not _has_more(data, page, len(res)):
+                q_saved = 1
+                break
             page += 1
-            time.sleep(sleep_base)
-        per_query_stats.append({"query": q, "count": got})
+        q_stat = {"query": q, "count": got, "requests_saved": q_saved}
+        if cp["pages"]:
+            q_stat["resumed_pages"] = len(cp["pages"])
+        sub_count = 0
+        if subdivide and capped:
+            sub = _subdivide(pool, region, q, q_rows, workers)
+            if sub:
+                sub_count = sub["count"]
+                got += sub_count
+                q_stat.update(count=got, cells=sub["cells"], cell_requests=sub["requests"])
+        # 分页与细分都完成后才标记 done；细分中途中断时重跑细分，按 uid 去重
+        get_writer().put([], _cp(checkpoint, region, q, count=sub_count, done=True), owner=pool)
+        per_query_stats.append(q_stat)
         total += got
-    return {"inserted_or_updated": total, "per_query": per_query_stats}
+        saved += q_saved
+    pool.flush()
+    get_writer().flush(owner=pool)
+    return {"inserted_or_updated": total, "per_query": per_query_stats, "requests_saved": saved}
+
+async def _fetch_page_async(pool: KeyPool, region: str, query: str, page: int, city_limit: bool,
+                            sem: asyncio.Semaphore, executor, checkpoint: str = None, on_page: Callable = None):
+    loop = asyncio.get_running_loop()
+    async with sem:
+        data = await loop.run_in_executor(executor, fetch_page, pool, region, query, page, city_limit)
+        rows = normalize_rows(data.get("results") or [], query)
+        get_writer().put(rows, _cp(checkpoint, region, query, page=page, total=_total_of(data) or None,
+                                   count=len(rows)) if rows else None, owner=pool)
+        if on_page and rows:
+            on_page(region, query, page, len(rows), _total_of(data))
+    return data, rows
+
+async def _paginate_async(pool: KeyPool, region: str, query: str, city_limit: bool,
+                          sem: asyncio.Semaphore, executor, checkpoint: str = None, have=(), total: int = None,
+                          on_page: Callable = None):
+    # have 为断点里已入库的页号，续跑时只补缺失的页
+    def fetch(p):
+        return _fetch_page_async(pool, region, query, p, city_limit, sem, executor, checkpoint, on_page)
+    rows = []
+    if 0 not in have:
+        data, rows = await fetch(0)
+        total = _total_of(data)
+        if not rows:
+            return rows, total, 0
+        if not _has_more(data, 0, len(rows)):
+            return rows, total, 1
+    if total:
+        # 已知总数：剩余页全部并发发出
+        pages = [p for p in range(1, (total + PAGE_SIZE - 1) // PAGE_SIZE) if p not in have]
+        done = await asyncio.gather(*[fetch(p) for p in pages])
+        return rows + [r for _, rs in done for r in rs], total, 1
+    # 没有 total 字段时退回逐页翻取
+    page = max(have, default=0) + 1
+    while True:
+        data, rs = await fetch(page)
+        rows += rs
+        if not rs:
+            return rows, total or 0, 0
+        if not _has_more(data, page, len(rs)):
+            return rows, total or 0, 1
+        page += 1
+
+async def _crawl_query_async(pool: KeyPool, region: str, query: str, city_limit: bool,
+                             sem: asyncio.Semaphore, executor, subdivide: bool = False, workers: int = 4,
+                             checkpoint: str = None, cp: Dict[str, Any] = None, on_page: Callable = None):
+    if cp and cp["done"]:
+        return {"query": query, "count": cp["count"], "requests_saved": 0, "resumed": True}
+    prev = cp["count"] if cp else 0
+    rows, total, saved = await _paginate_async(pool, region, query, city_limit, sem, executor, checkpoint,
+                                               cp["pages"] if cp else (), cp["total"] if cp else None, on_page)
+    stat = {"query": query, "count": prev + len(rows), "requests_saved": saved}
+    if cp and cp["pages"]:
+        stat["resumed_pages"] = len(cp["pages"])
+    sub_count = 0
+    if subdivide and total >= RESULT_CAP:
+        loop = asyncio.get_running_loop()
+        sub = await loop.run_in_executor(executor, _subdivide, pool, region, query, rows, workers)
+        if sub:
+            sub_count = sub["count"]
+            stat.update(count=stat["count"] + sub_count, cells=sub["cells"], cell_requests=sub["requests"])
+    get_writer().put([], _cp(checkpoint, region, query, count=sub_count, done=True), owner=pool)
+    return stat
+
+async def _crawl_region_async(pool: KeyPool, region: str, queries: List[str], city_limit: bool,
+                              sem: asyncio.Semaphore, executor, subdivide: bool = False, workers: int = 4,
+                              checkpoint: str = None, on_page: Callable = None):
+    cps = await asyncio.get_running_loop().run_in_executor(
+        executor, load_checkpoints, checkpoint, region) if checkpoint else {}
+    per_query_stats = await asyncio.gather(*[
+        _crawl_query_async(pool, region, q, city_limit, sem, executor, subdivide, workers, checkpoint, cps.get(q),
+                           on_page)
+        for q in queries
+    ])
+    return {"inserted_or_updated": sum(s["count"] for s in per_query_stats),
+            "per_query": list(per_query_stats),
+            "requests_saved": sum(s["requests_saved"] for s in per_query_stats)}
+
+async def crawl_regions_async(ak: Union[str, List[str], KeyPool], regions: List[str], queries: List[str],
+                              qps: float = 2.0, city_limit=True, concurrency: int = 8, burst: int = None,
+                              daily_quota: int = None, subdivide: bool = False, workers: int = 4,
+                              checkpoint: str = None, on_page: Callable = None):
+    # 限速统一交给按 AK 共享的令牌桶（request_once 内部领取），这里只限制并发数
+    pool = KeyPool.of(ak, qps=qps, burst=burst, daily_quota=daily_quota)
+    sem = asyncio.Semaphore(max(1, concurrency))
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, concurrency) + 2) as executor:
+            outs = await asyncio.gather(*[
+                _crawl_region_async(pool, reg, queries, city_limit, sem, executor, subdivide, workers, checkpoint,
+                                    on_page)
+                for reg in regions
+            ], return_exceptions=True)
+    finally:
+        if pool is not ak:
+            pool.close()
+    pool.flush()
+    get_writer().flush(owner=pool)
+    return list(zip(regions, outs))
+
+def crawl_region_async(ak: Union[str, List[str], KeyPool], region: str, queries: List[str], qps: float = 2.0,
+                       city_limit=True, concurrency: int = 8, subdivide: bool = False, workers: int = 4):
+    (_, out), = asyncio.run(crawl_regions_async(ak, [region], queries, qps=qps, city_limit=city_limit,
+                                                concurrency=concurrency, subdivide=subdivide, workers=workers))
+    if isinstance(out, BaseException):
+        raise out
+    return out
@@ -1,7 +1,17 @@
+import json
 import math
+import time
+import queue
+import atexit
 import sqlite3
+import threading
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Iterable, Dict, Any
+from typing import Iterable, Dict, Any, List, Optional
+
+import numpy as np
+
+import coords
 
 DB_PATH = Path("./poi.sqlite")
 
@@ -30,42 +40,532 @@ CREATE TABLE IF NOT EXISTS poi (
 );
 """
 
-def get_conn():
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute("PRAGMA journal_mode=WAL;")
-    conn.execute(DDL)
+AK_USAGE_DDL = """
+CREATE TABLE IF NOT EXISTS ak_usage (
+  ak TEXT NOT NULL,
+  day TEXT NOT NULL,
+  requests INTEGER NOT NULL DEFAULT 0,
+  failures INTEGER NOT NULL DEFAULT 0,
+  disabled TEXT,
+  PRIMARY KEY (ak, day)
+);
+"""
+
+# 派生坐标列：入库时由 lat/lng（GCJ-02）一次算好，读路径直接使用
+COORD_COLUMNS = ("lng_wgs", "lat_wgs", "lng_bd", "lat_bd")
+
+def _migrate_coord_columns(conn):
+    for c in COORD_COLUMNS:
+        conn.execute(f"ALTER TABLE poi ADD COLUMN {c} REAL")
+    cur = conn.execute("SELECT rowid, lng, lat FROM poi WHERE lat IS NOT NULL AND lng IS NOT NULL")
+    while True:
+        batch = cur.fetchmany(5000)
+        if not batch:
+            break
+        rids, lngs, lats = zip(*batch)
+        conn.executemany("UPDATE poi SET lng_wgs=?, lat_wgs=?, lng_bd=?, lat_bd=? WHERE rowid=?",
+                         [(*d, rid) for d, rid in zip(_derive_coords(lngs, lats), rids)])
+
+INDEX_DDL = """
+CREATE INDEX IF NOT EXISTS idx_poi_source_query ON poi(source_query);
+CREATE INDEX IF NOT EXISTS idx_poi_adcode ON poi(adcode);
+CREATE INDEX IF NOT EXISTS idx_poi_city_area ON poi(city, area);
+CREATE INDEX IF NOT EXISTS idx_poi_area ON poi(area);
+CREATE INDEX IF NOT EXISTS idx_poi_lat_lng ON poi(lat, lng);
+"""
+
+# R*Tree 空间索引（WGS-84，与地图视口一致），id 即 poi.rowid，由触发器随 poi 的增删改同步
+RTREE_DDL = """
+CREATE VIRTUAL TABLE IF NOT EXISTS poi_rtree USING rtree(id, min_lng, max_lng, min_lat, max_lat);
+CREATE TRIGGER IF NOT EXISTS poi_rtree_ai AFTER INSERT ON poi
+WHEN new.lng_wgs IS NOT NULL AND new.lat_wgs IS NOT NULL BEGIN
+  INSERT OR REPLACE INTO poi_rtree VALUES (new.rowid, new.lng_wgs, new.lng_wgs, new.lat_wgs, new.lat_wgs);
+END;
+CREATE TRIGGER IF NOT EXISTS poi_rtree_au AFTER UPDATE OF lng_wgs, lat_wgs ON poi BEGIN
+  DELETE FROM poi_rtree WHERE id = old.rowid;
+  INSERT INTO poi_rtree SELECT new.rowid, new.lng_wgs, new.lng_wgs, new.lat_wgs, new.lat_wgs
+  WHERE new.lng_wgs IS NOT NULL AND new.lat_wgs IS NOT NULL;
+END;
+CREATE TRIGGER IF NOT EXISTS poi_rtree_ad AFTER DELETE ON poi BEGIN
+  DELETE FROM poi_rtree WHERE id = old.rowid;
+END;
+INSERT OR REPLACE INTO poi_rtree
+  SELECT rowid, lng_wgs, lng_wgs, lat_wgs, lat_wgs FROM poi WHERE lng_wgs IS NOT NULL AND lat_wgs IS NOT NULL;
+"""
+
+# 分级网格聚合：每个级别对应一个地图缩放级别，格子边长约为该级别下一张 256px 瓦片的 1/GRID_DIV；
+# 每格按 source_query 记录点数与坐标和（求质心用），由触发器随 poi 增量维护
+GRID_LEVELS = (2, 4, 6, 8, 10, 12)
+GRID_DIV = 4
+
+def _grid_cell(level: int) -> float:
+    return 360.0 / (2 ** level) / GRID_DIV
+
+def _grid_sql(level: int, row: str, sign: str) -> str:
+    cell = repr(_grid_cell(level))
+    return f"""
+  INSERT INTO poi_grid(level, gx, gy, source_query, n, sum_lng, sum_lat)
+  SELECT {level}, CAST(({row}.lng_wgs + 180.0) / {cell} AS INTEGER), CAST(({row}.lat_wgs + 90.0) / {cell} AS INTEGER),
+         COALESCE({row}.source_query, ''), {sign}1, {sign}{row}.lng_wgs, {sign}{row}.lat_wgs
+  WHERE {row}.lng_wgs IS NOT NULL AND {row}.lat_wgs IS NOT NULL
+  ON CONFLICT(level, gx, gy, source_query) DO UPDATE SET
+    n = n + excluded.n, sum_lng = sum_lng + excluded.sum_lng, sum_lat = sum_lat + excluded.sum_lat;"""
+
+def _grid_ddl() -> str:
+    add = "".join(_grid_sql(lv, "new", "") for lv in GRID_LEVELS)
+    sub = "".join(_grid_sql(lv, "old", "-") for lv in GRID_LEVELS)
+    prune = "\n  DELETE FROM poi_grid WHERE n <= 0;"
+    backfill = "".join(f"""
+INSERT INTO poi_grid(level, gx, gy, source_query, n, sum_lng, sum_lat)
+SELECT {lv}, CAST((lng_wgs + 180.0) / {_grid_cell(lv)!r} AS INTEGER), CAST((lat_wgs + 90.0) / {_grid_cell(lv)!r} AS INTEGER),
+       COALESCE(source_query, ''), COUNT(*), SUM(lng_wgs), SUM(lat_wgs)
+FROM poi WHERE lng_wgs IS NOT NULL AND lat_wgs IS NOT NULL GROUP BY 2, 3, 4;""" for lv in GRID_LEVELS)
+    return f"""
+CREATE TABLE IF NOT EXISTS poi_grid (
+  level INTEGER NOT NULL,
+  gx INTEGER NOT NULL,
+  gy INTEGER NOT NULL,
+  source_query TEXT NOT NULL,
+  n INTEGER NOT NULL,
+  sum_lng REAL NOT NULL,
+  sum_lat REAL NOT NULL,
+  PRIMARY KEY (level, gx, gy, source_query)
+) WITHOUT ROWID;
+CREATE TRIGGER IF NOT EXISTS poi_grid_ai AFTER INSERT ON poi BEGIN{add}
+END;
+CREATE TRIGGER IF NOT EXISTS poi_grid_au AFTER UPDATE OF lng_wgs, lat_wgs, source_query ON poi BEGIN{sub}{add}{prune}
+END;
+CREATE TRIGGER IF NOT EXISTS poi_grid_ad AFTER DELETE ON poi BEGIN{sub}{prune}
+END;
+{backfill}
+"""
+
+def _grid_prune_sql(level: int) -> str:
+    # 只删旧行所在、计数已减到 0 的那一格（主键查找），不扫整张 poi_grid
+    cell = repr(_grid_cell(level))
+    return f"""
+  DELETE FROM poi_grid WHERE level = {level}
+    AND gx = CAST((old.lng_wgs + 180.0) / {cell} AS INTEGER) AND gy = CAST((old.lat_wgs + 90.0) / {cell} AS INTEGER)
+    AND source_query = COALESCE(old.source_query, '') AND n <= 0;"""
+
+def _grid_triggers_ddl() -> str:
+    # 替换 _grid_ddl 里的更新/删除触发器：原来每次都全表扫描删除 n <= 0 的格子；
+    # 另外坐标与分类都没变的 upsert（重复抓取、重复导入）不再改动网格
+    add = "".join(_grid_sql(lv, "new", "") for lv in GRID_LEVELS)
+    sub = "".join(_grid_sql(lv, "old", "-") for lv in GRID_LEVELS)
+    prune = "".join(_grid_prune_sql(lv) for lv in GRID_LEVELS)
+    return f"""
+DROP TRIGGER IF EXISTS poi_grid_au;
+DROP TRIGGER IF EXISTS poi_grid_ad;
+CREATE TRIGGER poi_grid_au AFTER UPDATE OF lng_wgs, lat_wgs, source_query ON poi
+WHEN old.lng_wgs IS NOT new.lng_wgs OR old.lat_wgs IS NOT new.lat_wgs OR old.source_query IS NOT new.source_query
+BEGIN{sub}{prune}{add}
+END;
+CREATE TRIGGER poi_grid_ad AFTER DELETE ON poi BEGIN{sub}{prune}
+END;
+"""
+
+# 数据版本号：每次写事务 +1，矢量瓦片等派生缓存据此判断是否失效
+META_DDL = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+INSERT OR IGNORE INTO meta(key, value) VALUES ('data_version', 0);
+"""
+
+JOBS_DDL = """
+CREATE TABLE IF NOT EXISTS jobs (
+  id TEXT PRIMARY KEY,
+  kind TEXT NOT NULL,
+  status TEXT NOT NULL,
+  params TEXT NOT NULL,
+  progress TEXT,
+  result TEXT,
+  error TEXT,
+  created_at REAL NOT NULL,
+  started_at REAL,
+  finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created_at);
+"""
+
+# 抓取断点：按 (任务, 区县, 关键词) 记录已完成的页号、API 返回的 total、已入库条数与是否完成
+CHECKPOINT_DDL = """
+CREATE TABLE IF NOT EXISTS crawl_checkpoint (
+  job_key TEXT NOT NULL,
+  region TEXT NOT NULL,
+  query TEXT NOT NULL,
+  pages TEXT NOT NULL DEFAULT '[]',
+  total INTEGER,
+  count INTEGER NOT NULL DEFAULT 0,
+  done INTEGER NOT NULL DEFAULT 0,
+  updated_at REAL,
+  PRIMARY KEY (job_key, region, query)
+);
+"""
+
+# 多进程部署时的任务认领：owner 为执行该任务的 JobManager，heartbeat 为它最近一次心跳；
+# cancel_requested 把取消请求写进库里，由执行任务的进程轮询，跨进程也能取消
+JOBS_OWNER_DDL = """
+ALTER TABLE jobs ADD COLUMN owner TEXT;
+ALTER TABLE jobs ADD COLUMN heartbeat REAL;
+ALTER TABLE jobs ADD COLUMN cancel_requested INTEGER NOT NULL DEFAULT 0;
+"""
+
+# poi 原来只有 TEXT 主键，poi_rtree.id 用的是隐式 rowid，而 VACUUM 可能重排这种 rowid，R*Tree 就会连到错行。
+# 重建为带 INTEGER PRIMARY KEY 的表：id 取原 rowid，现有 R*Tree 与网格都不用重算，之后 id 不会再被重排。
+# 删表会连带删掉索引和触发器，在同一个事务里重建
+POI_RTREE_TRIGGERS_DDL = """
+CREATE TRIGGER poi_rtree_ai AFTER INSERT ON poi
+WHEN new.lng_wgs IS NOT NULL AND new.lat_wgs IS NOT NULL BEGIN
+  INSERT OR REPLACE INTO poi_rtree VALUES (new.id, new.lng_wgs, new.lng_wgs, new.lat_wgs, new.lat_wgs);
+END;
+CREATE TRIGGER poi_rtree_au AFTER UPDATE OF lng_wgs, lat_wgs ON poi BEGIN
+  DELETE FROM poi_rtree WHERE id = old.id;
+  INSERT INTO poi_rtree SELECT new.id, new.lng_wgs, new.lng_wgs, new.lat_wgs, new.lat_wgs
+  WHERE new.lng_wgs IS NOT NULL AND new.lat_wgs IS NOT NULL;
+END;
+CREATE TRIGGER poi_rtree_ad AFTER DELETE ON poi BEGIN
+  DELETE FROM poi_rtree WHERE id = old.id;
+END;
+"""
+
+def _migrate_poi_int_id(conn):
+    cols = [(r[1], r[2]) for r in conn.execute("PRAGMA table_info(poi)") if r[1] != "uid"]
+    names = ", ".join(c for c, _ in cols)
+    add = "".join(_grid_sql(lv, "new", "") for lv in GRID_LEVELS)
+    conn.executescript(f"""
+BEGIN;
+CREATE TABLE poi_new (
+  id INTEGER PRIMARY KEY,
+  uid TEXT UNIQUE,
+  {", ".join(f"{c} {t}" for c, t in cols)}
+);
+INSERT INTO poi_new(id, uid, {names}) SELECT rowid, uid, {names} FROM poi;
+DROP TABLE poi;
+ALTER TABLE poi_new RENAME TO poi;
+{INDEX_DDL}
+{POI_RTREE_TRIGGERS_DDL}
+CREATE TRIGGER poi_grid_ai AFTER INSERT ON poi BEGIN{add}
+END;
+{_grid_triggers_ddl()}
+COMMIT;
+""")
+
+# 按顺序执行的迁移；已执行到第几条记录在 PRAGMA user_version 里，只追加、不修改
+MIGRATIONS = [
+    DDL,
+    AK_USAGE_DDL,
+    _migrate_coord_columns,
+    INDEX_DDL,
+    RTREE_DDL,
+    _grid_ddl(),
+    META_DDL,
+    JOBS_DDL,
+    CHECKPOINT_DDL,
+    _grid_triggers_ddl(),
+    JOBS_OWNER_DDL,
+    _migrate_poi_int_id,
+]
+
+# 每个连接建立时设置；journal_mode 是库级持久设置，只在初始化时设一次
+PRAGMAS = {
+    "synchronous": "NORMAL",
+    "cache_size": -65536,
+    "mmap_size": 268435456,
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,
+}
+READ_POOL_SIZE = 8
+
+_init_lock = threading.Lock()
+_initialized = set()
+_read_pool: "queue.LifoQueue" = queue.LifoQueue()
+_write_lock = threading.RLock()
+_write_conn = None
+
+def configure(db_path=None, read_pool_size: int = None, **pragmas):
+    global DB_PATH, READ_POOL_SIZE
+    close_all()
+    if db_path is not None:
+        DB_PATH = Path(db_path)
+    if read_pool_size is not None:
+        READ_POOL_SIZE = max(1, int(read_pool_size))
+    PRAGMAS.update(pragmas)
+
+def _connect():
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    for k, v in PRAGMAS.items():
+        conn.execute(f"PRAGMA {k}={v};")
     return conn
 
+def _migrate(conn):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for i, step in enumerate(MIGRATIONS[version:], start=version + 1):
+        with conn:
+            if callable(step):
+                step(conn)
+            else:
+                conn.executescript(step)
+            conn.execute(f"PRAGMA user_version={i}")
+
+def init_db():
+    key = str(Path(DB_PATH).resolve())
+    if key in _initialized:
+        return
+    with _init_lock:
+        if key in _initialized:
+            return
+        conn = _connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL;")
+            _migrate(conn)
+        finally:
+            conn.close()
+        _initialized.add(key)
+
+def get_conn():
+    # 独立连接（调用方负责 close）；常规读写请用 read_conn() / write_conn()
+    init_db()
+    return _connect()
+
+@contextmanager
+def read_conn():
+    init_db()
+    try:
+        conn = _read_pool.get_nowait()
+    except queue.Empty:
+        conn = _connect()
+    try:
+        yield conn
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        if _read_pool.qsize() < READ_POOL_SIZE:
+            _read_pool.put(conn)
+        else:
+            conn.close()
+
+@contextmanager
+def write_conn():
+    # 全进程只有一个写连接，写操作在锁内串行执行
+    global _write_conn
+    init_db()
+    with _write_lock:
+        if _write_conn is None:
+            _write_conn = _connect()
+        yield _write_conn
+
+def close_all():
+    global _write_conn
+    with _write_lock:
+        if _write_conn is not None:
+            _write_conn.close()
+            _write_conn = None
+    while True:
+        try:
+            _read_pool.get_nowait().close()
+        except queue.Empty:
+            break
+    _initialized.clear()
+
+UPSERT_SQL = """
+INSERT INTO poi(uid,name,address,province,city,area,adcode,lat,lng,type,tag,classified_poi_tag,
+                telephone,detail,overall_rating,price,shop_hours,brand,content_tag,source_query,
+                lng_wgs,lat_wgs,lng_bd,lat_bd)
+VALUES (:uid,:name,:address,:province,:city,:area,:adcode,:lat,:lng,:type,:tag,:classified_poi_tag,
+        :telephone,:detail,:overall_rating,:price,:shop_hours,:brand,:content_tag,:source_query,
+        :lng_wgs,:lat_wgs,:lng_bd,:lat_bd)
+ON CONFLICT(uid) DO UPDATE SET
+  name=excluded.name,
+  address=excluded.address,
+  province=excluded.province,
+  city=excluded.city,
+  area=excluded.area,
+  adcode=excluded.adcode,
+  lat=excluded.lat,
+  lng=excluded.lng,
+  type=excluded.type,
+  tag=excluded.tag,
+  classified_poi_tag=excluded.classified_poi_tag,
+  telephone=excluded.telephone,
+  detail=excluded.detail,
+  overall_rating=excluded.overall_rating,
+  price=excluded.price,
+  shop_hours=excluded.shop_hours,
+  brand=excluded.brand,
+  content_tag=excluded.content_tag,
+  source_query=excluded.source_query,
+  lng_wgs=excluded.lng_wgs,
+  lat_wgs=excluded.lat_wgs,
+  lng_bd=excluded.lng_bd,
+  lat_bd=excluded.lat_bd
+"""
+
+def _derive_coords(lng, lat) -> List[tuple]:
+    # 整列向量化换算，返回每行 (lng_wgs, lat_wgs, lng_bd, lat_bd)，缺失坐标为 None
+    lng = np.array([np.nan if v is None else v for v in lng], dtype=np.float64)
+    lat = np.array([np.nan if v is None else v for v in lat], dtype=np.float64)
+    cols = np.column_stack([*coords.gcj02_to_wgs84(lng, lat), *coords.gcj02_to_bd09(lng, lat)])
+    return [(None,) * 4 if np.isnan(c[0]) else tuple(c) for c in cols.tolist()]
+
+def _with_coords(rows: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    rows = list(rows)
+    if not rows:
+        return rows
+    derived = _derive_coords([r.get("lng") for r in rows], [r.get("lat") for r in rows])
+    return [{**r, **dict(zip(COORD_COLUMNS, d))} for r, d in zip(rows, derived)]
+
+def _bump_version(conn):
+    conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'data_version'")
+
+def data_version() -> int:
+    with read_conn() as conn:
+        r = conn.execute("SELECT value FROM meta WHERE key = 'data_version'").fetchone()
+    return r[0] if r else 0
+
+def _save_checkpoint(conn, job_key: str, region: str, query: str, page: int = None, total: int = None,
+                     count: int = 0, done: bool = False):
+    conn.execute("""
+    INSERT INTO crawl_checkpoint(job_key, region, query, pages, total, count, done, updated_at)
+    VALUES (?, ?, ?, json_array(?), ?, ?, ?, ?)
+    ON CONFLICT(job_key, region, query) DO UPDATE SET
+      pages = CASE WHEN excluded.pages = '[null]' THEN pages ELSE json_insert(pages, '$[#]', ?) END,
+      total = COALESCE(excluded.total, total),
+      count = count + excluded.count,
+      done = MAX(done, excluded.done),
+      updated_at = excluded.updated_at
+    """, (job_key, region, query, page, total, count, int(done), time.time(), page))
+
+def load_checkpoints(job_key: str, region: str) -> Dict[str, Dict[str, Any]]:
+    with read_conn() as conn:
+        cur = conn.execute("""SELECT query, pages, total, count, done FROM crawl_checkpoint
+                              WHERE job_key=? AND region=?""", (job_key, region))
+        return {r[0]: {"pages": {p for p in json.loads(r[1]) if p is not None}, "total": r[2],
+                       "count": r[3], "done": bool(r[4])} for r in cur.fetchall()}
+
+def clear_checkpoints(job_key: str):
+    with write_conn() as conn, conn:
+        conn.execute("DELETE FROM crawl_checkpoint WHERE job_key=?", (job_key,))
+
 def upsert_rows(rows: Iterable[Dict[str, Any]]):
-    conn = get_conn()
-    with conn:
-        conn.executemany("""
-        INSERT INTO poi(uid,name,address,province,city,area,adcode,lat,lng,type,tag,classified_poi_tag,
-                        telephone,detail,overall_rating,price,shop_hours,brand,content_tag,source_query)
-        VALUES (:uid,:name,:address,:province,:city,:area,:adcode,:lat,:lng,:type,:tag,:classified_poi_tag,
-                :telephone,:detail,:overall_rating,:price,:shop_hours,:brand,:content_tag,:source_query)
-        ON CONFLICT(uid) DO UPDATE SET
-          name=excluded.name,
-          address=excluded.address,
-          province=excluded.province,
-          city=excluded.city,
-          area=excluded.area,
-          adcode=excluded.adcode,
-          lat=excluded.lat,
-          lng=excluded.lng,
-          type=excluded.type,
-          tag=excluded.tag,
-          classified_poi_tag=excluded.classified_poi_tag,
-          telephone=excluded.telephone,
-          detail=excluded.detail,
-          overall_rating=excluded.overall_rating,
-          price=excluded.price,
-          shop_hours=excluded.shop_hours,
-          brand=excluded.brand,
-          content_tag=excluded.content_tag,
-          source_query=excluded.source_query
-        """, list(rows))
-    conn.close()
+    rows = _with_coords(rows)
+    with write_conn() as conn, conn:
+        conn.executemany(UPSERT_SQL, rows)
+        _bump_version(conn)
+
+class BatchWriter:
+    # 单独的写线程：各处 put() 进队列，按行数 / 时间窗口攒成大事务提交，避免每页一次 fsync
+    def __init__(self, batch_rows: int = 2000, flush_interval: float = 1.0):
+        self.batch_rows = max(1, int(batch_rows))
+        self.flush_interval = max(0.05, float(flush_interval))
+        self._q: "queue.Queue" = queue.Queue()
+        self._closed = False
+        # 写入错误按 owner（产生数据的任务）分别记录，只在该任务自己 flush 时抛出
+        self._errors: Dict[Any, BaseException] = {}
+        self._rows_written = 0
+        self._batches = 0
+        self._write_secs = 0.0
+        self._started = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="poi-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, rows: Iterable[Dict[str, Any]], checkpoint: Dict[str, Any] = None, owner: Any = None):
+        # checkpoint 与这批行在同一个事务里提交，保证断点不会先于数据落盘
+        if self._closed:
+            raise RuntimeError("writer 已关闭")
+        rows = list(rows)
+        if rows or checkpoint:
+            self._q.put((rows, [checkpoint] if checkpoint else [], owner))
+
+    def flush(self, timeout: float = None, owner: Any = None):
+        # 阻塞到此前 put 的数据全部提交；只抛出同一 owner 的数据写入失败，不把别的任务的错误算到调用方头上
+        ev = threading.Event()
+        self._q.put(ev)
+        ev.wait(timeout)
+        err = self._errors.pop(owner, None)
+        if err is not None:
+            raise err
+
+    def close(self, timeout: float = None):
+        if self._closed:
+            return
+        self._closed = True
+        self._q.put(None)
+        self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        elapsed = max(1e-9, time.monotonic() - self._started)
+        return {
+            "rows_written": self._rows_written,
+            "batches": self._batches,
+            "pending_items": self._q.qsize(),
+            "write_seconds": round(self._write_secs, 3),
+            "rows_per_sec": round(self._rows_written / elapsed, 1),
+            "rows_per_write_sec": round(self._rows_written / self._write_secs, 1) if self._write_secs else 0.0,
+        }
+
+    def _write(self, buf: List[Dict[str, Any]], cps: List[Dict[str, Any]], owners: set):
+        if not buf and not cps:
+            return
+        t0 = time.monotonic()
+        try:
+            with write_conn() as conn, conn:
+                if buf:
+                    conn.executemany(UPSERT_SQL, _with_coords(buf))
+                    _bump_version(conn)
+                for cp in cps:
+                    _save_checkpoint(conn, **cp)
+            self._rows_written += len(buf)
+            self._batches += 1
+        except Exception as e:
+            # 同一事务里合并了多个 owner 的数据，回滚后它们都算失败
+            for o in owners:
+                self._errors[o] = e
+        self._write_secs += time.monotonic() - t0
+
+    def _run(self):
+        buf: List[Dict[str, Any]] = []
+        cps: List[Dict[str, Any]] = []
+        owners = set()
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._q.get(timeout=timeout)
+            except queue.Empty:
+                item = ()
+            if isinstance(item, tuple) and item:
+                buf.extend(item[0])
+                cps.extend(item[1])
+                owners.add(item[2])
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+                if len(buf) < self.batch_rows:
+                    continue
+            self._write(buf, cps, owners)
+            buf, cps, owners, deadline = [], [], set(), None
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is None:
+                break
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_writer() -> BatchWriter:
+    global _writer
+    with _writer_lock:
+        if _writer is None or _writer._closed:
+            _writer = BatchWriter()
+        return _writer
+
+def close_writer():
+    global _writer
+    with _writer_lock:
+        w, _writer = _writer, None
+    if w is not None:
+        w.close()
+
+atexit.register(close_writer)
 
 PI = math.pi
 AXIS = 6378245.0
@@ -101,34 +601,279 @@ def gcj02_to_wgs84(lng, lat):
     mgLng = lng + dlng
     return (lng * 2 - mgLng, lat * 2 - mgLat)
 
-def fetch_geojson(source_query: str = None):
-    conn = get_conn()
-    cur = conn.cursor()
-    if source_query:
-        cur.execute("""SELECT * FROM poi
-                       WHERE lat IS NOT NULL AND lng IS NOT NULL AND source_query=?""", (source_query,))
+def _feature(r: Dict[str, Any], skip=("id", "lng", "lat") + COORD_COLUMNS) -> Dict[str, Any]:
+    lng_wgs, lat_wgs = r["lng_wgs"], r["lat_wgs"]
+    if lng_wgs is None or lat_wgs is None:
+        lng_wgs, lat_wgs = gcj02_to_wgs84(r["lng"], r["lat"])
+    return {
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [lng_wgs, lat_wgs]},
+        "properties": {k: r[k] for k in r if k not in skip}
+    }
+
+def _select_sql(source_query: str = None, bbox=None, limit: int = None, city: str = None, adcode: str = None,
+                columns: List[str] = None):
+    # bbox = (min_lng, min_lat, max_lng, max_lat)，WGS-84；先用 R*Tree 粗筛，再按精确坐标过滤
+    if bbox:
+        min_lng, min_lat, max_lng, max_lat = bbox
+        cols = ", ".join(f"p.{c}" for c in columns) if columns else "p.*"
+        sql = f"""SELECT {cols} FROM poi_rtree r JOIN poi p ON p.id = r.id
+                 WHERE r.min_lng <= ? AND r.max_lng >= ? AND r.min_lat <= ? AND r.max_lat >= ?
+                   AND p.lng_wgs BETWEEN ? AND ? AND p.lat_wgs BETWEEN ? AND ?"""
+        params = [max_lng, min_lng, max_lat, min_lat, min_lng, max_lng, min_lat, max_lat]
+        prefix = "p."
     else:
-        cur.execute("""SELECT * FROM poi
-                       WHERE lat IS NOT NULL AND lng IS NOT NULL""")
-    cols = [c[0] for c in cur.description]
-    rows = [dict(zip(cols, r)) for r in cur.fetchall()]
-    conn.close()
-
-    feats = []
-    for r in rows:
-        lng_gcj, lat_gcj = r["lng"], r["lat"]
-        lng_wgs, lat_wgs = gcj02_to_wgs84(lng_gcj, lat_gcj)
-        feats.append({
-            "type": "Feature",
-            "geometry": {"type": "Point", "coordinates": [lng_wgs, lat_wgs]},
-            "properties": {k: r[k] for k in r if k not in ("lng","lat")}
-        })
+        sql = f"SELECT {', '.join(columns) if columns else '*'} FROM poi WHERE lat IS NOT NULL AND lng IS NOT NULL"
+        params = []
+        prefix = ""
+    for col, val in (("source_query", source_query), ("city", city), ("adcode", adcode)):
+        if val:
+            sql += f" AND {prefix}{col}=?"
+            params.append(val)
+    if limit:
+        sql += " LIMIT ?"
+        params.append(int(limit))
+    return sql, params
+
+def iter_features(source_query: str = None, batch: int = 2000, bbox=None, limit: int = None):
+    # 逐批从游标取行并转换，不在内存里攒整张表
+    with read_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(*_select_sql(source_query, bbox, limit))
+        cols = [c[0] for c in cur.description]
+        while True:
+            rows = cur.fetchmany(batch)
+            if not rows:
+                break
+            for r in rows:
+                yield _feature(dict(zip(cols, r)))
+
+def iter_rows(columns: List[str], batch: int = 5000, source_query: str = None, bbox=None,
+              city: str = None, adcode: str = None):
+    # 按批 yield 指定列的元组列表（导出用，不构造 dict）；lng/lat 两列输出 WGS-84，与 /data 的几何坐标一致
+    cols = list(columns) + ["lng_wgs", "lat_wgs"]
+    n = len(columns)
+    i_lng, i_lat = columns.index("lng"), columns.index("lat")
+    with read_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(*_select_sql(source_query, bbox, city=city, adcode=adcode, columns=cols))
+        while True:
+            rows = cur.fetchmany(batch)
+            if not rows:
+                break
+            out = []
+            for r in rows:
+                r = list(r)
+                lng_wgs, lat_wgs = r[n], r[n + 1]
+                if lng_wgs is None or lat_wgs is None:
+                    lng_wgs, lat_wgs = gcj02_to_wgs84(r[i_lng], r[i_lat])
+                r[i_lng], r[i_lat] = lng_wgs, lat_wgs
+                out.append(r[:n])
+            yield out
+
+def fetch_geojson(source_query: str = None):
+    return {"type": "FeatureCollection", "features": list(iter_features(source_query))}
+
+def query_bbox(min_lng: float, min_lat: float, max_lng: float, max_lat: float,
+               source_query: str = None, limit: int = None):
+    feats = list(iter_features(source_query, bbox=(min_lng, min_lat, max_lng, max_lat), limit=limit))
     return {"type": "FeatureCollection", "features": feats}
 
+def iter_geojson(source_query: str = None, batch: int = 2000, bbox=None, limit: int = None):
+    # 流式输出 FeatureCollection 文本：每批特征序列化后作为一个块 yield
+    yield '{"type": "FeatureCollection", "features": ['
+    sep, buf = "", []
+    for f in iter_features(source_query, batch=batch, bbox=bbox, limit=limit):
+        buf.append(json.dumps(f, ensure_ascii=False))
+        if len(buf) >= batch:
+            yield sep + ",".join(buf)
+            sep, buf = ",", []
+    if buf:
+        yield sep + ",".join(buf)
+    yield "]}"
+
+def query_clusters(min_lng: float, min_lat: float, max_lng: float, max_lat: float, zoom: int,
+                   source_query: str = None):
+    # 取不超过 zoom 的最细网格级别，把同一格内各分类的计数合并成一个聚合点
+    level = max([lv for lv in GRID_LEVELS if lv <= zoom] or [GRID_LEVELS[0]])
+    cell = _grid_cell(level)
+    gx0, gx1 = int((min_lng + 180.0) // cell), int((max_lng + 180.0) // cell)
+    gy0, gy1 = int((min_lat + 90.0) // cell), int((max_lat + 90.0) // cell)
+    sql = """SELECT gx, gy, source_query, n, sum_lng, sum_lat FROM poi_grid
+             WHERE level=? AND gx BETWEEN ? AND ? AND gy BETWEEN ? AND ? AND n > 0"""
+    params = [level, gx0, gx1, gy0, gy1]
+    if source_query:
+        sql += " AND source_query=?"
+        params.append(source_query)
+    cells: Dict[tuple, Dict[str, Any]] = {}
+    with read_conn() as conn:
+        for gx, gy, sq, n, slng, slat in conn.execute(sql, params):
+            c = cells.setdefault((gx, gy), {"n": 0, "lng": 0.0, "lat": 0.0, "counts": {}})
+            c["n"] += n
+            c["lng"] += slng
+            c["lat"] += slat
+            c["counts"][sq or "其他"] = c["counts"].get(sq or "其他", 0) + n
+    feats = [{
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [c["lng"] / c["n"], c["lat"] / c["n"]]},
+        "properties": {"count": c["n"], "counts": c["counts"], "cell": [gx, gy]}
+    } for (gx, gy), c in cells.items()]
+    return {"type": "FeatureCollection", "level": level, "features": feats}
+
+def points_in_bbox(min_lng: float, min_lat: float, max_lng: float, max_lat: float, limit: int = None):
+    # 只取出图需要的列：(lng_wgs, lat_wgs, uid, name, source_query)
+    sql = """SELECT p.lng_wgs, p.lat_wgs, p.uid, p.name, p.source_query
+             FROM poi_rtree r JOIN poi p ON p.id = r.id
+             WHERE r.min_lng <= ? AND r.max_lng >= ? AND r.min_lat <= ? AND r.max_lat >= ?"""
+    params = [max_lng, min_lng, max_lat, min_lat]
+    if limit:
+        sql += " LIMIT ?"
+        params.append(int(limit))
+    with read_conn() as conn:
+        return conn.execute(sql, params).fetchall()
+
 def list_categories():
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT source_query, COUNT(*) FROM poi GROUP BY source_query ORDER BY COUNT(*) DESC")
-    rows = [{"source_query": r[0], "count": r[1]} for r in cur.fetchall()]
-    conn.close()
+    with read_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT source_query, COUNT(*) FROM poi GROUP BY source_query ORDER BY COUNT(*) DESC")
+        rows = [{"source_query": r[0], "count": r[1]} for r in cur.fetchall()]
+    return rows
+
+def load_ak_usage(day: str) -> Dict[str, Dict[str, Any]]:
+    with read_conn() as conn:
+        cur = conn.execute("SELECT ak, requests, failures, disabled FROM ak_usage WHERE day=?", (day,))
+        out = {r[0]: {"requests": r[1], "failures": r[2], "disabled": r[3]} for r in cur.fetchall()}
+    return out
+
+def add_ak_usage(day: str, deltas: Dict[str, Dict[str, Any]]):
+    if not deltas:
+        return
+    with write_conn() as conn, conn:
+        conn.executemany("""
+        INSERT INTO ak_usage(ak, day, requests, failures, disabled)
+        VALUES (:ak, :day, :requests, :failures, :disabled)
+        ON CONFLICT(ak, day) DO UPDATE SET
+          requests=requests+excluded.requests,
+          failures=failures+excluded.failures,
+          disabled=COALESCE(excluded.disabled, disabled)
+        """, [{"ak": ak, "day": day, "requests": d.get("requests", 0), "failures": d.get("failures", 0),
+               "disabled": d.get("disabled")} for ak, d in deltas.items()])
+
+def list_ak_usage(days: int = 7):
+    with read_conn() as conn:
+        cur = conn.execute("""SELECT ak, day, requests, failures, disabled FROM ak_usage
+                              WHERE day >= date('now', 'localtime', ?) ORDER BY day DESC, requests DESC""",
+                           (f"-{max(0, days-1)} day",))
+        rows = [{"ak": r[0], "day": r[1], "requests": r[2], "failures": r[3], "disabled": r[4]}
+                for r in cur.fetchall()]
     return rows
+
+def region_extent(region: str):
+    with read_conn() as conn:
+        cur = conn.execute("""SELECT MIN(lat), MIN(lng), MAX(lat), MAX(lng) FROM poi
+                              WHERE lat IS NOT NULL AND lng IS NOT NULL AND (area=? OR city=?)""", (region, region))
+        r = cur.fetchone()
+    return None if r is None or r[0] is None else tuple(r)
+
+# 读路径上的热点查询，explain_hot_queries() 用来确认它们都走索引而不是全表扫描
+HOT_QUERIES = {
+    "data_by_source_query": ("""SELECT * FROM poi
+                                WHERE lat IS NOT NULL AND lng IS NOT NULL AND source_query=?""", ("美食",)),
+    "categories": ("SELECT source_query, COUNT(*) FROM poi GROUP BY source_query ORDER BY COUNT(*) DESC", ()),
+    "region_extent": ("""SELECT MIN(lat), MIN(lng), MAX(lat), MAX(lng) FROM poi
+                         WHERE lat IS NOT NULL AND lng IS NOT NULL AND (area=? OR city=?)""", ("城关区", "城关区")),
+    "by_adcode": ("SELECT * FROM poi WHERE adcode=?", ("620102",)),
+    "by_city_area": ("SELECT * FROM poi WHERE city=? AND area=?", ("兰州市", "城关区")),
+    "bbox": _select_sql(bbox=(103.7, 36.0, 103.9, 36.1)),
+    "export_by_city": _select_sql(city="兰州市", columns=["uid", "lng", "lat"]),
+    "export_by_adcode": _select_sql(adcode="620102", columns=["uid", "lng", "lat"]),
+    "lat_lng_range": ("SELECT uid FROM poi WHERE lat BETWEEN ? AND ? AND lng BETWEEN ? AND ?",
+                      (36.0, 36.1, 103.7, 103.9)),
+}
+
+def explain(sql: str, params=()) -> List[str]:
+    with read_conn() as conn:
+        return [r[-1] for r in conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()]
+
+def explain_hot_queries() -> Dict[str, Dict[str, Any]]:
+    out = {}
+    for name, (sql, params) in HOT_QUERIES.items():
+        plan = explain(sql, params)
+        full_scan = any(p.startswith("SCAN poi") and "INDEX" not in p for p in plan)
+        out[name] = {"plan": plan, "uses_index": not full_scan}
+    return out
+
+def _job_row(r) -> Dict[str, Any]:
+    return {"id": r[0], "kind": r[1], "status": r[2], "params": json.loads(r[3]),
+            "progress": json.loads(r[4]) if r[4] else {}, "result": json.loads(r[5]) if r[5] else None,
+            "error": r[6], "created_at": r[7], "started_at": r[8], "finished_at": r[9]}
+
+JOB_COLS = "id, kind, status, params, progress, result, error, created_at, started_at, finished_at"
+
+def create_job(job_id: str, kind: str, params: Dict[str, Any]):
+    with write_conn() as conn, conn:
+        conn.execute("INSERT INTO jobs(id, kind, status, params, created_at) VALUES (?, ?, 'queued', ?, ?)",
+                     (job_id, kind, json.dumps(params, ensure_ascii=False), time.time()))
+
+def update_job(job_id: str, **fields):
+    # 可更新 status / progress / result / error / started_at / finished_at / owner / cancel_requested；字典字段自动序列化
+    sets, params = [], []
+    for k, v in fields.items():
+        if k not in ("status", "progress", "result", "error", "started_at", "finished_at", "owner",
+                     "cancel_requested"):
+            raise ValueError(f"未知字段：{k}")
+        sets.append(f"{k}=?")
+        params.append(json.dumps(v, ensure_ascii=False) if isinstance(v, (dict, list)) else v)
+    with write_conn() as conn, conn:
+        conn.execute(f"UPDATE jobs SET {', '.join(sets)} WHERE id=?", params + [job_id])
+
+def claim_job(job_id: str, owner: str) -> bool:
+    # 只有仍在排队的任务能被认领；多个进程同时认领同一任务时只有一个 UPDATE 命中
+    now = time.time()
+    with write_conn() as conn, conn:
+        cur = conn.execute("UPDATE jobs SET status='running', owner=?, heartbeat=?, started_at=?, cancel_requested=0 "
+                           "WHERE id=? AND status='queued'", (owner, now, now, job_id))
+    return cur.rowcount == 1
+
+def cancel_job(job_id: str) -> Optional[str]:
+    # 排队中的直接标记为已取消；执行中的只记下取消请求，由执行它的进程结束任务。返回取消时的状态
+    with write_conn() as conn, conn:
+        if conn.execute("UPDATE jobs SET status='cancelled', finished_at=? WHERE id=? AND status='queued'",
+                        (time.time(), job_id)).rowcount:
+            return "queued"
+        if conn.execute("UPDATE jobs SET cancel_requested=1 WHERE id=? AND status='running'", (job_id,)).rowcount:
+            return "running"
+    return None
+
+def heartbeat_jobs(owner: str) -> List[str]:
+    # 刷新 owner 名下执行中任务的心跳，返回其中已被请求取消的任务 id
+    with write_conn() as conn, conn:
+        conn.execute("UPDATE jobs SET heartbeat=? WHERE owner=? AND status='running'", (time.time(), owner))
+        return [r[0] for r in conn.execute(
+            "SELECT id FROM jobs WHERE owner=? AND status='running' AND cancel_requested=1", (owner,))]
+
+def requeue_stale_jobs(kind: str, stale_before: float) -> List[str]:
+    # 心跳早于 stale_before 的执行中任务视为所属进程已退出，放回队列；条件更新保证只有一个进程接手
+    with write_conn() as conn, conn:
+        ids = [r[0] for r in conn.execute(
+            "SELECT id FROM jobs WHERE kind=? AND status='running' AND (heartbeat IS NULL OR heartbeat < ?) "
+            "ORDER BY created_at", (kind, stale_before))]
+        return [i for i in ids if conn.execute(
+            "UPDATE jobs SET status='queued', owner=NULL WHERE id=? AND status='running' "
+            "AND (heartbeat IS NULL OR heartbeat < ?)", (i, stale_before)).rowcount]
+
+def get_job(job_id: str):
+    with read_conn() as conn:
+        r = conn.execute(f"SELECT {JOB_COLS} FROM jobs WHERE id=?", (job_id,)).fetchone()
+    return _job_row(r) if r else None
+
+def list_jobs(limit: int = 50, statuses=None):
+    sql = f"SELECT {JOB_COLS} FROM jobs"
+    params: List[Any] = []
+    if statuses:
+        sql += f" WHERE status IN ({','.join('?' * len(statuses))})"
+        params.extend(statuses)
+    sql += " ORDER BY created_at DESC LIMIT ?"
+    params.append(int(limit))
+    with read_conn() as conn:
+        return [_job_row(r) for r in conn.execute(sql, params).fetchall()]
@@ -0,0 +1,54 @@
+import threading
+from typing import Dict, Any
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# 连接池参数：POOL_CONNECTIONS 为缓存的主机数，POOL_MAXSIZE 为单个主机的最大连接数
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE = 16
+POOL_BLOCK = True
+
+_session = None
+_lock = threading.Lock()
+
+def _build_session(pool_connections: int, pool_maxsize: int, pool_block: bool) -> requests.Session:
+    s = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                          pool_block=pool_block, max_retries=0)
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    s.headers.update({"Connection": "keep-alive"})
+    return s
+
+def get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = _build_session(POOL_CONNECTIONS, POOL_MAXSIZE, POOL_BLOCK)
+    return _session
+
+def configure(pool_connections: int = None, pool_maxsize: int = None, pool_block: bool = None):
+    # 调整池大小后重建会话；旧会话的空闲连接随之关闭
+    global _session, POOL_CONNECTIONS, POOL_MAXSIZE, POOL_BLOCK
+    with _lock:
+        if pool_connections is not None:
+            POOL_CONNECTIONS = max(1, int(pool_connections))
+        if pool_maxsize is not None:
+            POOL_MAXSIZE = max(1, int(pool_maxsize))
+        if pool_block is not None:
+            POOL_BLOCK = bool(pool_block)
+        old, _session = _session, _build_session(POOL_CONNECTIONS, POOL_MAXSIZE, POOL_BLOCK)
+    if old is not None:
+        old.close()
+
+def http_get(url: str, params: Dict[str, Any] = None, timeout: float = 20) -> requests.Response:
+    return get_session().get(url, params=params, timeout=timeout)
+
+def close():
+    global _session
+    with _lock:
+        old, _session = _session, None
+    if old is not None:
+        old.close()
@@ -0,0 +1,194 @@
+import os
+import time
+import uuid
+import queue
+import socket
+import threading
+from collections import deque, OrderedDict
+from typing import Dict, Any, Callable, List, Optional, Tuple
+
+from db import (create_job, update_job, get_job, list_jobs, claim_job, cancel_job, heartbeat_jobs,
+                requeue_stale_jobs)
+
+PROGRESS_FLUSH_SECS = 1.0
+# 执行中任务的心跳间隔（同时拉取跨进程的取消请求），以及心跳停了多久视为所属进程已退出
+HEARTBEAT_SECS = 5.0
+JOB_STALE_SECS = 60.0
+# 每个任务在内存里保留的最近事件数，以及结束后还保留事件日志的任务数
+EVENT_BUFFER = 1000
+KEEP_FINISHED_LOGS = 100
+
+class JobCancelled(Exception):
+    pass
+
+class EventLog:
+    # 单个任务的事件流：emit 只做加锁追加，不落库；订阅方按序号增量读取，缓冲满时丢弃最旧的事件
+    def __init__(self):
+        self.seq = 0
+        self.closed = False
+        self._items: deque = deque(maxlen=EVENT_BUFFER)
+        self._cond = threading.Condition()
+
+    def emit(self, event: str, data: Dict[str, Any], close: bool = False):
+        with self._cond:
+            self.seq += 1
+            self._items.append((self.seq, event, data))
+            self.closed = self.closed or close
+            self._cond.notify_all()
+
+    def since(self, after: int, timeout: float = None) -> Tuple[List[Tuple[int, str, Dict[str, Any]]], bool]:
+        # 返回序号大于 after 的事件以及日志是否已结束；没有新事件时最多等待 timeout 秒
+        with self._cond:
+            if self.seq <= after and not self.closed:
+                self._cond.wait(timeout)
+            return [it for it in self._items if it[0] > after], self.closed
+
+class Job:
+    # 交给 runner 的任务句柄：读参数、上报进度、检查是否被取消
+    def __init__(self, job_id: str, params: Dict[str, Any], manager: "JobManager"):
+        self.id = job_id
+        self.params = params
+        self._manager = manager
+        self._progress: Dict[str, Any] = {}
+        self._flushed = 0.0
+        self._events = manager._log(job_id)
+
+    @property
+    def cancelled(self) -> bool:
+        return self.id in self._manager._cancelled
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise JobCancelled(self.id)
+
+    def progress(self, force: bool = False, **kw):
+        self._progress.update(kw)
+        now = time.monotonic()
+        if force or now - self._flushed >= PROGRESS_FLUSH_SECS:
+            self._flushed = now
+            update_job(self.id, progress=self._progress)
+
+    def emit(self, event: str, **data):
+        self._events.emit(event, data)
+
+class JobManager:
+    # 后台任务：submit 只写库入队，workers 个线程依次执行；状态持久化在 jobs 表，重启后继续未完成的任务
+    # 多个进程共用一个库时，任务按 jobs.status 条件更新认领，执行中的任务靠心跳标明归属
+    def __init__(self, kind: str, runner: Callable[[Job], Dict[str, Any]], workers: int = 2):
+        self.kind = kind
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.runner = runner
+        self.workers = max(1, int(workers))
+        self._q: "queue.Queue" = queue.Queue()
+        self._threads: List[threading.Thread] = []
+        self._cancelled = set()
+        self._lock = threading.Lock()
+        self._logs: "OrderedDict[str, EventLog]" = OrderedDict()
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            # 排队中的任务各进程都可以放进自己的队列，谁先认领谁执行；执行中的只接手心跳已停的
+            for job in reversed(list_jobs(limit=10000, statuses=("queued",))):
+                if job["kind"] == self.kind:
+                    self._q.put(job["id"])
+            self._requeue_stale()
+            for i in range(self.workers):
+                t = threading.Thread(target=self._loop, name=f"{self.kind}-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+            t = threading.Thread(target=self._beat, name=f"{self.kind}-heartbeat", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, params: Dict[str, Any]) -> str:
+        self.start()
+        job_id = uuid.uuid4().hex[:12]
+        create_job(job_id, self.kind, params)
+        self._log(job_id).emit("status", {"status": "queued"})
+        self._q.put(job_id)
+        return job_id
+
+    def cancel(self, job_id: str) -> bool:
+        state = cancel_job(job_id)
+        if state is None:
+            return False
+        if state == "running":
+            # 本进程在跑的任务立即生效；别的进程在下一次心跳时读到取消请求
+            self._cancelled.add(job_id)
+        else:
+            self._log(job_id).emit("end", {"status": "cancelled"}, close=True)
+        return True
+
+    def retry(self, job_id: str) -> bool:
+        # 失败、取消或部分出错的任务重新入队；runner 按 job id 读取断点续跑
+        job = get_job(job_id)
+        if not job or job["kind"] != self.kind or job["status"] in ("queued", "running"):
+            return False
+        self.start()
+        self._cancelled.discard(job_id)
+        update_job(job_id, status="queued", error=None, finished_at=None, owner=None, cancel_requested=0)
+        self._log(job_id, fresh=True).emit("status", {"status": "queued", "retry": True})
+        self._q.put(job_id)
+        return True
+
+    def events(self, job_id: str, create: bool = False) -> Optional[EventLog]:
+        # 本进程内提交或执行过的任务才有事件日志；create=True 时为排队/执行中的任务先建好日志等待订阅
+        if create:
+            return self._log(job_id)
+        with self._lock:
+            return self._logs.get(job_id)
+
+    def _log(self, job_id: str, fresh: bool = False) -> EventLog:
+        with self._lock:
+            log = self._logs.get(job_id)
+            if log is None or fresh:
+                log = self._logs[job_id] = EventLog()
+            self._logs.move_to_end(job_id)
+            finished = [k for k, v in self._logs.items() if v.closed]
+            for k in finished[:max(0, len(finished) - KEEP_FINISHED_LOGS)]:
+                del self._logs[k]
+            return log
+
+    def _requeue_stale(self):
+        for job_id in requeue_stale_jobs(self.kind, time.time() - JOB_STALE_SECS):
+            self._log(job_id).emit("status", {"status": "queued"})
+            self._q.put(job_id)
+
+    def _beat(self):
+        while True:
+            time.sleep(HEARTBEAT_SECS)
+            try:
+                self._cancelled.update(heartbeat_jobs(self.owner))
+                self._requeue_stale()
+            except Exception:
+                pass
+
+    def _loop(self):
+        while True:
+            job_id = self._q.get()
+            if not claim_job(job_id, self.owner):
+                # 已被别的 worker / 进程认领，或排队时被取消：后者不会走到下面的 finally，这里清掉取消标记，
+                # 免得 retry 后又被当成已取消
+                self._cancelled.discard(job_id)
+                continue
+            job = get_job(job_id)
+            handle = Job(job_id, job["params"], self)
+            handle.emit("status", status="running")
+            end = {}
+            try:
+                result = self.runner(handle)
+                update_job(job_id, status="done", result=result, progress=handle._progress,
+                           finished_at=time.time())
+                end = {"status": "done", "result": result}
+            except JobCancelled:
+                update_job(job_id, status="cancelled", progress=handle._progress, finished_at=time.time())
+                end = {"status": "cancelled"}
+            except Exception as e:
+                update_job(job_id, status="failed", error=str(e), progress=handle._progress,
+                           finished_at=time.time())
+                end = {"status": "failed", "error": str(e)}
+            finally:
+                self._cancelled.discard(job_id)
+                handle._events.emit("end", end or {"status": "failed"}, close=True)
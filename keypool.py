@@ -0,0 +1,156 @@
+import threading
+from datetime import datetime
+from typing import Dict, Any, List, Callable, Union
+
+from db import load_ak_usage, add_ak_usage
+from ratelimit import get_limiter, set_limit, release_limit
+
+DEFAULT_DAILY_QUOTA = 30000
+FLUSH_EVERY = 50
+
+# 百度返回这些状态码时，说明 key 本身不可用（配额耗尽 / 权限或校验失败），应移出轮换
+QUOTA_STATUSES = {4, 302}
+PERMISSION_STATUSES = {3, 5, 101, 102, 200, 201, 202, 203, 210, 211, 220, 230, 231, 233, 240, 250, 251, 252, 260, 261}
+
+class ApiStatusError(RuntimeError):
+    def __init__(self, status, message=""):
+        super().__init__(f"API status={status} msg={message}")
+        self.status = status
+        self.message = message
+
+    @property
+    def status_code(self) -> int:
+        try:
+            return int(self.status)
+        except (TypeError, ValueError):
+            return -1
+
+    @property
+    def key_dead(self) -> bool:
+        code = self.status_code
+        return code in QUOTA_STATUSES or code in PERMISSION_STATUSES
+
+def _today() -> str:
+    return datetime.now().strftime("%Y-%m-%d")
+
+class KeyPool:
+    # 多 AK 轮换：按「剩余配额 + 令牌桶等待时间」挑选 key，计数落库到 ak_usage，重启后延续
+    def __init__(self, aks: List[str], qps: float = 2.0, burst: int = None,
+                 daily_quota: int = None):
+        aks = [a.strip() for a in aks if a and a.strip()]
+        if not aks:
+            raise ValueError("缺少 AK")
+        self.aks = list(dict.fromkeys(aks))
+        self.daily_quota = max(1, int(daily_quota or DEFAULT_DAILY_QUOTA))
+        self._lock = threading.Lock()
+        self._day = _today()
+        self._used: Dict[str, int] = {}
+        self._disabled: Dict[str, str] = {}
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._pending_n = 0
+        # 本池对各 AK 的限速声明，close() 时撤销
+        self._leases = {ak: set_limit(ak, max(0.5, qps), burst) for ak in self.aks}
+        self._load()
+
+    @classmethod
+    def of(cls, ak: Union[str, List[str], "KeyPool"], **kw) -> "KeyPool":
+        if isinstance(ak, KeyPool):
+            return ak
+        if isinstance(ak, str):
+            ak = [a for a in ak.replace("\n", ",").split(",")]
+        return cls(ak, **kw)
+
+    @property
+    def primary(self) -> str:
+        return self.aks[0]
+
+    def _load(self):
+        usage = load_ak_usage(self._day)
+        self._used = {ak: usage.get(ak, {}).get("requests", 0) for ak in self.aks}
+        self._disabled = {ak: usage[ak]["disabled"] for ak in self.aks if usage.get(ak, {}).get("disabled")}
+
+    def _roll_day(self):
+        day = _today()
+        if day != self._day:
+            self._flush_locked()
+            self._day = day
+            self._load()
+
+    def remaining(self, ak: str) -> int:
+        return self.daily_quota - self._used.get(ak, 0)
+
+    def pick(self) -> str:
+        with self._lock:
+            self._roll_day()
+            live = [ak for ak in self.aks if ak not in self._disabled and self.remaining(ak) > 0]
+            if not live:
+                raise RuntimeError("所有 AK 均已耗尽配额或被停用")
+            # 优先选不需要等待的 key，其次剩余配额多的
+            ak = min(live, key=lambda a: (get_limiter(a).wait_time(), -self.remaining(a)))
+            self._used[ak] = self._used.get(ak, 0) + 1
+            return ak
+
+    def _note(self, ak: str, requests: int = 0, failures: int = 0, disabled: str = None):
+        d = self._pending.setdefault(ak, {"requests": 0, "failures": 0, "disabled": None})
+        d["requests"] += requests
+        d["failures"] += failures
+        if disabled:
+            d["disabled"] = disabled
+        self._pending_n += 1
+        if self._pending_n >= FLUSH_EVERY or disabled:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        pending, self._pending, self._pending_n = self._pending, {}, 0
+        add_ak_usage(self._day, pending)
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def close(self):
+        # 落盘计数并撤销限速声明；可重复调用
+        self.flush()
+        leases, self._leases = self._leases, {}
+        for ak, lease in leases.items():
+            release_limit(ak, lease)
+
+    def disable(self, ak: str, reason: str):
+        with self._lock:
+            self._disabled[ak] = reason
+            self._note(ak, disabled=reason)
+
+    def _settle(self, ak: str, attempts: int, ok: bool):
+        # pick() 已为第一次请求预扣 1 次，这里按实际发出的次数补齐；成功时只有重试算失败
+        with self._lock:
+            self._used[ak] = self._used.get(ak, 0) + attempts - 1
+            self._note(ak, requests=attempts, failures=attempts - 1 if ok else attempts)
+
+    def request(self, make_params: Callable[[str], Dict[str, Any]],
+                send: Callable[[Dict[str, Any], Callable[[], None]], Any]):
+        # 单次请求：选 key → 发送；key 失效时自动切换到下一个 key 重发
+        # send(params, on_attempt) 内部可能重试，每次真实请求调用一次 on_attempt
+        while True:
+            ak = self.pick()
+            attempts = [0]
+            def on_attempt():
+                attempts[0] += 1
+            try:
+                out = send(make_params(ak), on_attempt)
+            except ApiStatusError as e:
+                self._settle(ak, attempts[0], ok=False)
+                if e.key_dead:
+                    self.disable(ak, str(e))
+                    continue
+                raise
+            except Exception:
+                self._settle(ak, attempts[0], ok=False)
+                raise
+            self._settle(ak, attempts[0], ok=True)
+            return out
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [{"ak": ak[:4] + "***" + ak[-4:], "used_today": self._used.get(ak, 0),
+                     "remaining": self.remaining(ak), "disabled": self._disabled.get(ak)}
+                    for ak in self.aks]
@@ -0,0 +1,135 @@
+import math
+import shutil
+import struct
+import uuid
+from pathlib import Path
+from typing import Dict, Any, List, Tuple, Iterable
+
+import numpy as np
+
+EXTENT = 4096
+BUFFER = 64
+LAYER_NAME = "poi"
+ATTRS = ("uid", "name", "source_query")
+CACHE_DIR = Path("./_tiles")
+
+# ---- 最小化的 protobuf 编码（只覆盖 Mapbox Vector Tile v2 用到的字段类型） ----
+def _varint(n: int) -> bytes:
+    out = bytearray()
+    while True:
+        b = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(b | 0x80)
+        else:
+            out.append(b)
+            return bytes(out)
+
+def _key(field: int, wire: int) -> bytes:
+    return _varint((field << 3) | wire)
+
+def _len_field(field: int, payload: bytes) -> bytes:
+    return _key(field, 2) + _varint(len(payload)) + payload
+
+def _packed(field: int, values: Iterable[int]) -> bytes:
+    return _len_field(field, b"".join(_varint(v) for v in values))
+
+def _zigzag(n: int) -> int:
+    return (n << 1) ^ (n >> 63)
+
+def _value(v) -> bytes:
+    if isinstance(v, bool):
+        return _key(7, 0) + _varint(int(v))
+    if isinstance(v, int):
+        return _key(6, 0) + _varint(_zigzag(v))
+    if isinstance(v, float):
+        return _key(3, 1) + struct.pack("<d", v)
+    return _len_field(1, str(v).encode("utf-8"))
+
+def encode_layer(name: str, points: List[Tuple[int, int, Dict[str, Any]]], extent: int = EXTENT) -> bytes:
+    # points: [(px, py, props)]，px/py 为瓦片内坐标（0..extent，允许落在缓冲区内）
+    keys: Dict[str, int] = {}
+    values: Dict[Any, int] = {}
+    feats = []
+    for i, (px, py, props) in enumerate(points):
+        tags = []
+        for k, v in props.items():
+            if v is None or v == "":
+                continue
+            tags.append(keys.setdefault(k, len(keys)))
+            tags.append(values.setdefault((type(v).__name__, v), len(values)))
+        geom = (_varint(9) + _varint(_zigzag(px)) + _varint(_zigzag(py)))
+        body = _key(1, 0) + _varint(i + 1) + _packed(2, tags) + _key(3, 0) + _varint(1) + _len_field(4, geom)
+        feats.append(_len_field(2, body))
+    out = [_key(15, 0) + _varint(2), _len_field(1, name.encode("utf-8"))]
+    out.extend(feats)
+    out.extend(_len_field(3, k.encode("utf-8")) for k in keys)
+    out.extend(_len_field(4, _value(v)) for (_, v) in values)
+    out.append(_key(5, 0) + _varint(extent))
+    return b"".join(out)
+
+def encode_tile(layers: Dict[str, List[Tuple[int, int, Dict[str, Any]]]], extent: int = EXTENT) -> bytes:
+    return b"".join(_len_field(3, encode_layer(name, pts, extent)) for name, pts in layers.items() if pts)
+
+# ---- Web Mercator 瓦片坐标 ----
+def tile_bbox(z: int, x: int, y: int, buffer: int = 0, extent: int = EXTENT):
+    n = 2 ** z
+    pad = buffer / extent
+    def lng(tx): return tx / n * 360.0 - 180.0
+    def lat(ty): return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * ty / n))))
+    return (lng(x - pad), lat(min(n, y + 1 + pad)), lng(x + 1 + pad), lat(max(0, y - pad)))
+
+def project(lng, lat, z: int, x: int, y: int, extent: int = EXTENT):
+    # 向量化投影到瓦片内整数坐标
+    n = 2 ** z
+    lng = np.asarray(lng, dtype=np.float64)
+    lat = np.clip(np.asarray(lat, dtype=np.float64), -85.0511, 85.0511)
+    tx = (lng + 180.0) / 360.0 * n - x
+    rad = np.radians(lat)
+    ty = (1.0 - np.log(np.tan(rad) + 1.0 / np.cos(rad)) / np.pi) / 2.0 * n - y
+    return np.rint(tx * extent).astype(np.int64), np.rint(ty * extent).astype(np.int64)
+
+def build_tile(rows: List[Tuple], z: int, x: int, y: int, extent: int = EXTENT) -> bytes:
+    # rows: [(lng_wgs, lat_wgs, uid, name, source_query)]
+    if not rows:
+        return b""
+    lngs, lats = zip(*[(r[0], r[1]) for r in rows])
+    px, py = project(lngs, lats, z, x, y, extent)
+    pts = [(int(a), int(b), dict(zip(ATTRS, r[2:]))) for a, b, r in zip(px.tolist(), py.tolist(), rows)]
+    return encode_tile({LAYER_NAME: pts}, extent)
+
+# ---- 磁盘缓存：按数据版本分目录，版本变化后旧目录整体作废 ----
+def cache_path(version: int, z: int, x: int, y: int) -> Path:
+    return CACHE_DIR / str(version) / str(z) / str(x) / f"{y}.mvt"
+
+def _cached_versions() -> List[int]:
+    if not CACHE_DIR.exists():
+        return []
+    return [int(d.name) for d in CACHE_DIR.iterdir() if d.is_dir() and d.name.isdigit()]
+
+def read_cached(version: int, z: int, x: int, y: int):
+    # 旧版本目录可能正被清理，文件随时会消失，读不到一律按未命中处理
+    try:
+        return cache_path(version, z, x, y).read_bytes()
+    except FileNotFoundError:
+        return None
+
+def write_cached(version: int, z: int, x: int, y: int, data: bytes):
+    # 缓存写入尽力而为：已有更新版本的目录时说明这份数据已过期，不再写；并发写同一瓦片各用各的临时文件
+    versions = _cached_versions()
+    if any(v > version for v in versions):
+        return
+    p = cache_path(version, z, x, y)
+    tmp = p.with_name(f"{y}.{uuid.uuid4().hex[:8]}.tmp")
+    try:
+        p.parent.mkdir(parents=True, exist_ok=True)
+        tmp.write_bytes(data)
+        tmp.replace(p)
+    except FileNotFoundError:
+        # 目录被另一个请求当作旧版本清掉了
+        tmp.unlink(missing_ok=True)
+        return
+    # 只清理比当前版本旧的目录
+    for v in versions:
+        if v < version:
+            shutil.rmtree(CACHE_DIR / str(v), ignore_errors=True)
@@ -0,0 +1,113 @@
+import time
+import threading
+import itertools
+from contextlib import contextmanager
+from typing import Dict, Tuple
+
+DEFAULT_QPS = 2.0
+DEFAULT_BURST = 1
+
+class TokenBucket:
+    # 令牌桶：rate 为每秒补充的令牌数，burst 为桶容量；线程安全，可在多个爬取任务间共享
+    def __init__(self, rate: float = DEFAULT_QPS, burst: int = DEFAULT_BURST):
+        self._lock = threading.Lock()
+        self.rate = max(0.01, float(rate))
+        self.burst = max(1, int(burst))
+        self._tokens = float(self.burst)
+        self._stamp = time.monotonic()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def configure(self, rate: float = None, burst: int = None):
+        with self._lock:
+            self._refill(time.monotonic())
+            if rate is not None:
+                self.rate = max(0.01, float(rate))
+            if burst is not None:
+                self.burst = max(1, int(burst))
+                self._tokens = min(self._tokens, self.burst)
+
+    def reserve(self, n: float = 1.0) -> float:
+        # 预先扣除令牌（允许为负），返回调用方需要等待的秒数；排队顺序即扣除顺序
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= n
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def wait_time(self, n: float = 1.0) -> float:
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= n:
+                return 0.0
+            return (n - self._tokens) / self.rate
+
+    def acquire(self, n: float = 1.0):
+        wait = self.reserve(n)
+        if wait > 0:
+            time.sleep(wait)
+
+    def try_acquire(self, n: float = 1.0) -> bool:
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= n:
+                self._tokens -= n
+                return True
+            return False
+
+_limiters: Dict[str, TokenBucket] = {}
+# 每个 AK 当前生效的限速声明 {lease: (qps, burst)}：同时有多个任务在用时取最严的一个，
+# 声明全部释放后回到默认值；桶的速率只由这里决定，get_limiter 只查找不改
+_limits: Dict[str, Dict[int, Tuple[float, int]]] = {}
+_lease_ids = itertools.count(1)
+_registry_lock = threading.Lock()
+
+def _bucket_locked(key: str) -> TokenBucket:
+    b = _limiters.get(key)
+    if b is None:
+        b = _limiters[key] = TokenBucket()
+        _apply_locked(key)
+    return b
+
+def _apply_locked(key: str):
+    leases = _limits.get(key)
+    if leases:
+        rate, burst = min(q for q, _ in leases.values()), min(n for _, n in leases.values())
+    else:
+        rate, burst = DEFAULT_QPS, DEFAULT_BURST
+    _limiters[key].configure(rate=rate, burst=burst)
+
+def get_limiter(key: str) -> TokenBucket:
+    # 进程级共享：同一个 AK 无论被多少个请求/线程使用，都只对应一个令牌桶
+    with _registry_lock:
+        return _bucket_locked(key)
+
+def set_limit(key: str, qps: float, burst: int = None) -> int:
+    # 声明 key 的限速，返回 lease，用完交给 release_limit 撤销
+    with _registry_lock:
+        lease = next(_lease_ids)
+        _limits.setdefault(key, {})[lease] = (float(qps), int(burst or DEFAULT_BURST))
+        _bucket_locked(key)
+        _apply_locked(key)
+        return lease
+
+def release_limit(key: str, lease: int):
+    with _registry_lock:
+        leases = _limits.get(key) or {}
+        if leases.pop(lease, None) is None:
+            return
+        if not leases:
+            del _limits[key]
+        _apply_locked(key)
+
+@contextmanager
+def limit(key: str, qps: float, burst: int = None):
+    lease = set_limit(key, qps, burst)
+    try:
+        yield get_limiter(key)
+    finally:
+        release_limit(key, lease)
@@ -168,16 +168,76 @@ window.addEventListener('DOMContentLoaded', async () => {
         city_limit: (cityLimit.value === 'true')
       };
       const res = await postJSON('/crawl', body);
-      if (res.ok) {
-        const lines = (res.per_region || []).map(x => `【${x.region}】→ ${x.inserted_or_updated}`).join('；');
-        const errs  = (res.errors || []).map(e => `【${e.region}】${e.error}`).join('；');
-        status.textContent = `完成：入库 ${res.inserted_or_updated} 条。${lines}${errs ? '；错误：'+errs : ''}`;
-      } else {
-        status.textContent = `失败：${res.error || 'unknown'}`;
-      }
+      if (!res.ok) { status.textContent = `失败：${res.error || 'unknown'}`; return; }
+      status.textContent = `任务已提交（${res.job_id}），共 ${res.regions.length} 个区县，排队中…`;
+      await watchJob(res.job_id);
     } catch (e) { status.textContent = '请求失败：' + e.message; }
   });
 
+  function fmtEta(sec) {
+    if (sec == null) return '估算中';
+    if (sec < 60) return `${Math.round(sec)} 秒`;
+    if (sec < 3600) return `${Math.floor(sec / 60)} 分 ${Math.round(sec % 60)} 秒`;
+    return `${Math.floor(sec / 3600)} 小时 ${Math.round(sec % 3600 / 60)} 分`;
+  }
+
+  function renderJobEnd(jobId, job) {
+    if (job.status === 'done') {
+      const res = job.result || {};
+      const lines = (res.per_region || []).map(x => `【${x.region}】→ ${x.inserted_or_updated}`).join('；');
+      const errs  = (res.errors || []).map(e => `【${e.region}】${e.error}`).join('；');
+      status.textContent = `完成：入库 ${res.inserted_or_updated} 条。${lines}${errs ? '；错误：'+errs : ''}`;
+    } else {
+      status.textContent = `任务 ${jobId} ${job.status === 'cancelled' ? '已取消' : '失败：' + (job.error || 'unknown')}`;
+    }
+  }
+
+  // 优先用 SSE 逐页显示进度；浏览器不支持或连接被关闭时退回轮询 /jobs/<id>
+  function watchJob(jobId) {
+    if (!window.EventSource) return pollJob(jobId);
+    return new Promise(resolve => {
+      const es = new EventSource(`/crawl/${jobId}/events`);
+      const errs = [];
+      let last = null;
+      const render = () => {
+        if (!last) return;
+        status.textContent = `任务 ${jobId}：正在抓取【${last.region}】${last.query} 第 ${last.page + 1} 页，`
+          + `已取 ${last.pages} 页 / ${last.rows_total} 条，速率 ${last.rate} 次/秒，预计剩余 ${fmtEta(last.eta)}`
+          + (errs.length ? `\n错误 ${errs.length} 个：` + errs.slice(-3).join('；') : '');
+      };
+      es.addEventListener('status', ev => {
+        const d = JSON.parse(ev.data);
+        if (!last) status.textContent = `任务 ${jobId}：${d.status === 'queued' ? '排队中' : '正在抓取'}…`;
+      });
+      es.addEventListener('page', ev => { last = JSON.parse(ev.data); render(); });
+      es.addEventListener('crawl_error', ev => {
+        const d = JSON.parse(ev.data);
+        errs.push(`【${d.region}】${d.error}`);
+        if (last) { last.eta = d.eta; render(); }
+        else status.textContent = `任务 ${jobId}：【${d.region}】${d.error}`;
+      });
+      es.addEventListener('end', ev => { es.close(); renderJobEnd(jobId, JSON.parse(ev.data)); resolve(); });
+      es.onerror = () => {
+        if (es.readyState === EventSource.CLOSED) { pollJob(jobId).then(resolve); }
+      };
+    });
+  }
+
+  async function pollJob(jobId) {
+    while (true) {
+      await new Promise(r => setTimeout(r, 2000));
+      const job = await getJSON('/jobs/' + jobId);
+      const p = job.progress || {};
+      if (job.status === 'queued' || job.status === 'running') {
+        status.textContent = `任务 ${jobId}：${job.status === 'queued' ? '排队中' : '正在抓取'}… `
+          + `区县 ${p.regions_done || 0}/${p.regions_total || '?'}，已入库 ${p.inserted_or_updated || 0} 条`;
+        continue;
+      }
+      renderJobEnd(jobId, job);
+      return;
+    }
+  }
+
   btnRefreshCats.addEventListener('click', async () => {
     const res = await getJSON('/categories');
     catsBox.textContent = JSON.stringify(res, null, 2);
@@ -198,22 +258,30 @@ window.addEventListener('DOMContentLoaded', async () => {
     if (selectedFiles.length === 0){ csvStatus.textContent='请先添加 CSV 文件。'; return; }
     csvStatus.textContent='正在上传并合并…'; btnMerge.disabled=true;
     const fd = new FormData(); selectedFiles.forEach(f=>fd.append('files',f));
+    fd.append('coord_sys', document.getElementById('csvCoordSys').value);
+    fd.append('mode', document.getElementById('csvMode').value);
     try{
       const res = await fetch('/upload_csv',{method:'POST',body:fd});
       const data = await res.json();
       if (!data.ok){ csvStatus.textContent='合并失败：'+(data.msg||'未知错误'); btnMerge.disabled=false; return; }
-      currentGeoJSON=data.geojson;
-      csvStatus.textContent=`合并成功：${data.total_points} 个点\n`+JSON.stringify(data.files||[],null,2);
+      if (data.mode==='db'){
+        csvStatus.textContent=`已导入数据库：${data.total_points} 条\n`+JSON.stringify(data.files||[],null,2);
+        return;
+      }
+      // 流式模式不回传 GeoJSON，导出时由服务端读取最近一次合并结果文件
+      currentGeoJSON=data.geojson||null;
+      csvStatus.textContent=`合并成功：${data.total_points} 个点\n`
+        +(data.geojson_url?`结果文件：${data.geojson_url}\n`:'')+JSON.stringify(data.files||[],null,2);
       btnExport.disabled=false;
     }catch(e){ csvStatus.textContent='请求失败：'+e.message; }
     finally{ btnMerge.disabled=false; }
   });
 
   btnExport.addEventListener('click', async ()=>{
-    if (!currentGeoJSON){ csvStatus.textContent='没有可导出的数据'; return; }
     csvStatus.textContent='正在导出 HTML 地图…';
     try{
-      const payload={title:'合并POI地图',zoom:8,center:[34.0,108.0],geojson:currentGeoJSON};
+      const payload={title:'合并POI地图',zoom:8,center:[34.0,108.0]};
+      if (currentGeoJSON) payload.geojson=currentGeoJSON;
       const res=await fetch('/export_map',{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify(payload)});
       if(!res.ok){ const data=await res.json().catch(()=>({})); csvStatus.textContent='导出失败：'+(data.msg||res.statusText); return;}
       const blob=await res.blob();